@@ -1,7 +1,8 @@
-# Gathering station metadata
-Rscript scripts/gather-new-data/01_get_station_files.R
+# Gathering station metadata and exporting newly updated daily data for all databases at once, with every export running concurrently on a shared pool of database connections. This takes the same -s and -e arguments as the individual scripts to specify the start and end date respectively (in YYYY-MM-DD format). Defaults to starting 31 days before the current date
+python scripts/gather_new_data/gather_all.py "$@"
 
-# Exporting newly updated daily data. All of these scripts can take -s and -e arguments to specific the start and end date respectively (in YYYY-MM-DD format). Defaults to starting 31 days before the current date
-Rscript scripts/gather-new-data/02_export_hydat_csv.R
-Rscript scripts/gather-new-data/02_export_pacfish_csv.R
-Rscript scripts/gather-new-data/02_export_ecclimate_csv.R
\ No newline at end of file
+# The same exports can be run one after another using the individual scripts
+# python scripts/gather_new_data/01_get_station_files.py
+# python scripts/gather_new_data/02_export_hydat_csv.py
+# python scripts/gather_new_data/02_export_pacfish_csv.py
+# python scripts/gather_new_data/02_export_ecclimate_csv.py
@@ -4,10 +4,10 @@
 # conda activate depth2water
 
 # Posting new pacfish data to d2w
-python scripts/post-to-d2w/post_pacfish_to_d2w.py
+python scripts/post_to_d2w/post_pacfish_d2w.py
 
 # Posting new EC Climate data to d2w
-python scripts/post-to-d2w/post_ecclimate_to_d2w.py
+python scripts/post_to_d2w/post_ecclimate_d2w.py
 
 # Posting new Hydat data to d2w
-python scripts/post-to-d2w/post_hydat_to_d2w.py
\ No newline at end of file
+python scripts/post_to_d2w/post_hydat_d2w.py
\ No newline at end of file
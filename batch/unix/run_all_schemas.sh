@@ -0,0 +1,7 @@
+# Gathering and posting new data for all databases at once, replacing the gather_new_data.sh and post_to_d2w.sh scripts. Each database is run in its own process, with data gathered before it is posted. Takes the same -s and -e arguments as the gather and post scripts, and writes a log per database to the temporary directory. Workers can be set for all databases with -w, or per database with --schema-workers (e.g --schema-workers hydat=8,pacfish=2)
+
+# Activating the approriate conda environment
+# conda activate depth2water
+
+# Gathering and posting all databases
+python scripts/pipeline/run_all_schemas.py "$@"
@@ -0,0 +1,7 @@
+# Benchmarking the posting flow of each database against a local fake d2w server, using synthetic data generated in data/benchmark (see scripts/benchmark/generate_synthetic_data.py). Takes the same reconciliation options as the post scripts (e.g -w, -b, -a, -r), along with the scale of the data (-n stations, -d days) and the latency of the fake server (--latency, in seconds)
+
+# Activating the approriate conda environment
+# conda activate depth2water
+
+# Running the benchmarks
+python scripts/benchmark/run_benchmark.py "$@"
@@ -0,0 +1,116 @@
+import json
+import socket
+import threading
+from http.client import HTTPConnection
+from urllib.parse import urlparse, urlencode, quote
+
+# Raised for error responses from the fake server. The status code and headers are kept as on the d2w client's HTTP errors, so that rate control (see ThrottledClient) handles them in the same way
+class FakeD2WError(Exception):
+    def __init__(self, status_code, headers, detail):
+        super().__init__(str(status_code) + ': ' + str(detail))
+        self.status_code = status_code
+        self.response = FakeD2WResponse(status_code, headers)
+
+class FakeD2WResponse:
+    def __init__(self, status_code, headers):
+        self.status_code = status_code
+        self.headers = headers
+
+# Gets a station or data mapping as a dictionary, whether it is one already or an object built by the d2w mapping functions
+def mapping_to_dict(mapping):
+    if isinstance(mapping, dict):
+        return mapping
+    if hasattr(mapping, 'to_dict'):
+        return mapping.to_dict()
+    return dict(vars(mapping))
+
+class FakeD2WClient:
+    def __init__(self, url, monitoring_type='SURFACE_WATER'):
+        # Setting attributes. The monitoring type is the one created stations and uploaded csvs are added as
+        self.url = url.rstrip('/')
+        self.monitoring_type = monitoring_type
+        parsed = urlparse(self.url)
+        self.host = parsed.hostname
+        self.port = parsed.port
+
+        # One kept-alive connection per thread, as connections can't be shared between concurrent requests
+        self.local = threading.local()
+
+    def __str__(self):
+        outstr = "Fake d2w client for server at: " + self.url
+        return(outstr)
+
+    # Sends a request to the server (reconnecting once if a kept-alive connection was closed), returning the decoded JSON response. Error statuses are raised as a FakeD2WError
+    def request(self, method, path, query=None, data=None):
+        if query:
+            path = path + '?' + urlencode({key: value for key, value in query.items() if value is not None})
+        body = None if data is None else json.dumps(data, default=str)
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        for attempt in range(2):
+            try:
+                if getattr(self.local, 'conn', None) is None:
+                    self.local.conn = self.connect()
+                self.local.conn.request(method, path, body=body, headers=headers)
+                response = self.local.conn.getresponse()
+                payload = json.loads(response.read() or b'null')
+                break
+            except (ConnectionError, OSError):
+                if getattr(self.local, 'conn', None) is not None:
+                    self.local.conn.close()
+                self.local.conn = None
+                if attempt == 1:
+                    raise
+        if response.status >= 400:
+            raise FakeD2WError(response.status, dict(response.getheaders()), payload)
+        return payload
+
+    # Opens a connection to the server. Headers and bodies are sent separately, so Nagle's algorithm is disabled to keep requests with a body from waiting on delayed acknowledgements
+    def connect(self):
+        conn = HTTPConnection(self.host, self.port)
+        conn.connect()
+        conn.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return conn
+
+    # Follows a "next" link from a previous page
+    def get_url(self, url):
+        parsed = urlparse(url)
+        return self.request('GET', parsed.path + ('?' + parsed.query if parsed.query else ''))
+
+    # ===== Stations =====
+    def get_stations(self, owner=None, monitoring_type=None, url=None):
+        if url is not None:
+            return self.get_url(url)
+        return self.request('GET', '/stations', {'owner': owner, 'monitoring_type': monitoring_type})
+
+    def get_station_by_station_id(self, station_id, monitoring_type=None):
+        return self.request('GET', '/stations/' + quote(str(station_id)), {'monitoring_type': monitoring_type})
+
+    # Creates a station, as the client's monitoring type unless the mapping gives one
+    def create_station(self, station_mapping):
+        return self.request('POST', '/stations', data=dict({'monitoring_type': self.monitoring_type}, **mapping_to_dict(station_mapping)))
+
+    def update_station(self, id, data):
+        return self.request('PUT', '/stations/' + str(id), data=data)
+
+    # ===== Time series data =====
+    def get_data(self, monitoring_type, station_id=None, start_date=None, end_date=None, url=None, owner=None):
+        if url is not None:
+            return self.get_url(url)
+        return self.request('GET', '/data/' + monitoring_type, {'station_id': station_id, 'start_date': start_date, 'end_date': end_date, 'owner': owner})
+
+    def get_surface_water_data(self, station_id=None, start_date=None, end_date=None, url=None, owner=None):
+        return self.get_data('SURFACE_WATER', station_id, start_date, end_date, url, owner)
+
+    def get_climate_data(self, station_id=None, start_date=None, end_date=None, url=None, owner=None):
+        return self.get_data('CLIMATE', station_id, start_date, end_date, url, owner)
+
+    def update_surface_water_data(self, id, data):
+        return self.request('PUT', '/data/SURFACE_WATER/' + str(id), data=data)
+
+    def update_climate_data(self, id, data):
+        return self.request('PUT', '/data/CLIMATE/' + str(id), data=data)
+
+    # Uploads a csv of new data, as records of the client's monitoring type
+    def post_csv_file(self, fpath, mapping):
+        with open(fpath) as f:
+            return self.request('POST', '/data/' + self.monitoring_type, data={'mapping': mapping_to_dict(mapping), 'csv': f.read()})
@@ -0,0 +1,235 @@
+import io
+import csv
+import json
+import time
+import random
+from bisect import bisect_left, bisect_right
+from threading import Lock, Thread
+from urllib.parse import urlparse, parse_qs, urlencode
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Request handler for the fake server. Each request is routed to a method of the server, which returns a status code and a JSON-serializable body
+class FakeD2WHandler(BaseHTTPRequestHandler):
+    # Keeping connections alive between requests, as the d2w client's session does
+    protocol_version = 'HTTP/1.1'
+    # Sending responses without waiting on delayed acknowledgements
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def do_PUT(self):
+        self.handle_request('PUT')
+
+    def handle_request(self, method):
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length) if length > 0 else b''
+        (status, payload, headers) = self.server.d2w.respond(method, self.path, body)
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    # Silencing the per-request log lines
+    def log_message(self, format, *args):
+        pass
+
+class FakeD2WServer:
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, page_size=100, error_rate=0.0):
+        # Setting attributes. Every request is delayed by the latency plus a random jitter (both in seconds), and a fraction of requests (error_rate) are throttled with a 503, to exercise retries
+        self.latency = latency
+        self.jitter = jitter
+        self.page_size = page_size
+        self.error_rate = error_rate
+
+        # Server state: stations by server ID, and for each monitoring type the records of each station sorted by date
+        self.stations = dict()
+        self.records = dict()
+        self.dates = dict()
+        self.record_index = dict()
+        self.next_id = 1
+        self.next_record_id = 1
+        self.lock = Lock()
+
+        # The results of the last few data queries (ignoring the page offset), so that following the pages of a long query doesn't rebuild its results for every page. Cleared whenever the data changes
+        self.query_cache = dict()
+
+        # Counts of requests by route
+        self.requests = dict()
+
+        # Starting the HTTP server (on a free port if none is given) on a background thread
+        self.httpd = ThreadingHTTPServer((host, port), FakeD2WHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.d2w = self
+        self.thread = Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    def __str__(self):
+        outstr = "Fake d2w server at: " + self.url + '\n' + 'Latency: ' + str(self.latency) + 's (+/- ' + str(self.jitter) + 's)' + '\n' + 'Requests: ' + str(self.requests)
+        return(outstr)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def url(self):
+        return 'http://' + self.httpd.server_address[0] + ':' + str(self.httpd.server_address[1])
+
+    # ===== Server state =====
+    # Loads stations and data records into the server, as returned by the d2w server (see synthetic_server_state)
+    def load(self, monitoring_type, stations, records):
+        with self.lock:
+            for station in stations:
+                self.stations[station['id']] = dict(station, monitoring_type=monitoring_type)
+                self.next_id = max(self.next_id, station['id'] + 1)
+            for record in records:
+                self.add_record(monitoring_type, dict(record))
+                self.next_record_id = max(self.next_record_id, record['id'] + 1)
+
+    # Adds a record to a station's date-sorted list of records, replacing any existing record for the same date
+    def add_record(self, monitoring_type, record):
+        stat = record['station']['station_id']
+        records = self.records.setdefault(monitoring_type, dict()).setdefault(stat, [])
+        dates = self.dates.setdefault(monitoring_type, dict()).setdefault(stat, [])
+        i = bisect_left(dates, record['datetime'])
+        if i < len(dates) and dates[i] == record['datetime']:
+            records[i] = record
+        else:
+            dates.insert(i, record['datetime'])
+            records.insert(i, record)
+        self.record_index[(monitoring_type, record['id'])] = record
+        self.query_cache.clear()
+
+    def count(self, route):
+        with self.lock:
+            self.requests[route] = self.requests.get(route, 0) + 1
+
+    # ===== Routing =====
+    # Routes a request, returning a tuple of the status code, JSON body and any extra headers
+    def respond(self, method, path, body):
+        if self.latency > 0 or self.jitter > 0:
+            time.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+        url = urlparse(path)
+        parts = [part for part in url.path.split('/') if part != '']
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        route = method + ' /' + '/'.join(parts[:2])
+        self.count(route)
+        if self.error_rate > 0 and random.random() < self.error_rate:
+            return (503, {'detail': 'Service unavailable'}, {'Retry-After': '0'})
+        try:
+            if parts[0] == 'stations':
+                if method == 'GET' and len(parts) == 1:
+                    return (200, self.list_stations(query), {})
+                elif method == 'GET':
+                    return (200, self.find_station(parts[1], query), {})
+                elif method == 'POST':
+                    return (201, self.create_station(json.loads(body)), {})
+                elif method == 'PUT':
+                    return (200, self.update_station(int(parts[1]), json.loads(body)), {})
+            elif parts[0] == 'data':
+                monitoring_type = parts[1]
+                if method == 'GET':
+                    return (200, self.list_data(monitoring_type, query), {})
+                elif method == 'PUT':
+                    return (200, self.update_data(monitoring_type, int(parts[2]), json.loads(body)), {})
+                elif method == 'POST':
+                    return (201, self.upload_csv(monitoring_type, json.loads(body)), {})
+        except KeyError as e:
+            return (404, {'detail': 'Not found: ' + str(e)}, {})
+        except (ValueError, IndexError) as e:
+            return (400, {'detail': repr(e)}, {})
+        return (404, {'detail': 'Unknown route: ' + route}, {})
+
+    # Gets a page of a list of items, with a link to the next page (if there is one) that repeats the query
+    def page(self, path, query, items):
+        offset = int(query.get('offset', 0))
+        nxt = offset + self.page_size
+        link = None
+        if nxt < len(items):
+            link = self.url + path + '?' + urlencode(dict(query, offset=nxt))
+        return {'count': len(items), 'next': link, 'results': items[offset:nxt]}
+
+    # ===== Stations =====
+    def list_stations(self, query):
+        with self.lock:
+            stations = [station for station in self.stations.values() if
+                ('owner' not in query or str(station.get('owner')) == query['owner']) and
+                ('monitoring_type' not in query or station.get('monitoring_type') == query['monitoring_type'])]
+        return self.page('/stations', query, stations)
+
+    def find_station(self, station_id, query):
+        with self.lock:
+            return {'results': [station for station in self.stations.values() if station['station_id'] == station_id and ('monitoring_type' not in query or station.get('monitoring_type') == query['monitoring_type'])]}
+
+    def create_station(self, data):
+        with self.lock:
+            station = dict(data, id=self.next_id)
+            self.stations[station['id']] = station
+            self.next_id += 1
+        return station
+
+    def update_station(self, id, data):
+        with self.lock:
+            self.stations[id].update({key: value for key, value in data.items() if key != 'id'})
+            return self.stations[id]
+
+    # ===== Time series data =====
+    # Lists the records of one or all stations (optionally only those of an owner) within a date range, by station and then date
+    def list_data(self, monitoring_type, query):
+        start = query.get('start_date', '')[:10]
+        end = query.get('end_date', '')[:10] or '9999'
+        key = (monitoring_type, query.get('station_id'), query.get('owner'), start, end)
+        with self.lock:
+            if key not in self.query_cache:
+                bystation = self.records.get(monitoring_type, dict())
+                stats = [query['station_id']] if 'station_id' in query else sorted(bystation.keys())
+                if 'owner' in query:
+                    owned = set(station['station_id'] for station in self.stations.values() if str(station.get('owner')) == query['owner'] and station.get('monitoring_type', monitoring_type) == monitoring_type)
+                    stats = [stat for stat in stats if stat in owned]
+                records = []
+                for stat in stats:
+                    dates = self.dates.get(monitoring_type, dict()).get(stat, [])
+                    records.extend(bystation.get(stat, [])[bisect_left(dates, start):bisect_right(dates, end)])
+                # Keeping only a few queries, as concurrent stations each have their own
+                if len(self.query_cache) >= 256:
+                    self.query_cache.clear()
+                self.query_cache[key] = records
+            records = self.query_cache[key]
+        return self.page('/data/' + monitoring_type, query, records)
+
+    def update_data(self, monitoring_type, id, data):
+        with self.lock:
+            record = self.record_index[(monitoring_type, id)]
+            record.update({key: value for key, value in data.items() if key not in ['id', 'station', 'station_id']})
+            return dict(record)
+
+    # Adds the rows of an uploaded csv as new records, for stations of the monitoring type (or created without one). The mapping gives, for each server field, either the name of the csv column holding its values or a constant value
+    def upload_csv(self, monitoring_type, data):
+        mapping = data['mapping']
+        rows = list(csv.DictReader(io.StringIO(data['csv'])))
+        with self.lock:
+            stations = {station['station_id']: station for station in self.stations.values() if station.get('monitoring_type', monitoring_type) == monitoring_type}
+            for row in rows:
+                record = {key: (row[value] if isinstance(value, str) and value in row else value) for key, value in mapping.items() if key not in ['station_id', 'location_name']}
+                record = {key: (None if value == '' else value) for key, value in record.items()}
+                station = stations[row[mapping['station_id']]]
+                record['datetime'] = str(record['datetime'])[:10]
+                record['id'] = self.next_record_id
+                record['station'] = {'id': station['id'], 'station_id': station['station_id'], 'location_name': station.get('location_name')}
+                self.next_record_id += 1
+                self.add_record(monitoring_type, record)
+        return {'created': len(rows)}
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
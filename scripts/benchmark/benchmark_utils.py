@@ -0,0 +1,354 @@
+import io
+import os
+import time
+import string
+import asyncio
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from contextlib import redirect_stdout
+from depth2water import get_surface_water_mapping, get_climate_mapping
+from scripts.post_to_d2w.PostD2W import PostD2W
+from scripts.post_to_d2w.RunMetrics import RunMetrics
+from scripts.post_to_d2w.MeteredClient import MeteredClient
+from scripts.post_to_d2w.ThrottledClient import ThrottledClient
+from scripts.post_to_d2w.AsyncD2WClient import AsyncD2WClient
+from scripts.post_to_d2w.post_configs import POST_CONFIGS
+from scripts.post_to_d2w.post_utils import sync_stations, reconcile_stations, reconcile_stations_async, get_server_data_bulk
+from scripts.benchmark.FakeD2WClient import FakeD2WClient
+
+# Names of the schemas synthetic data can be generated for
+SCHEMAS = ['hydat', 'ecclimate', 'pacfish']
+
+# Constant columns added to the mapping of uploaded csvs for each schema, as in the post scripts
+UPLOAD_CONSTANTS = {
+    'hydat': {'comments': ''},
+    'ecclimate': {'comments': '', 'published': True},
+    'pacfish': {'comments': '', 'published': True}
+}
+
+# Gets the file paths of a schema's synthetic metadata and daily data within a directory, as a tuple
+def synthetic_paths(data_dir, schema):
+    return (data_dir + '/' + schema + '-metadata.csv', data_dir + '/' + schema + '-daily.csv')
+
+# Generates random station names
+def synthetic_names(rng, nstations, suffix):
+    letters = np.array(list(string.ascii_uppercase))
+    prefixes = [''.join(name) for name in rng.choice(letters, size=(nstations, 6))]
+    return [prefix + ' ' + suffix + ' ' + str(i) for i, prefix in enumerate(prefixes)]
+
+# Generates a station metadata table for a schema, with the columns and types of the files exported by the gather scripts. Stations are spread over BC, and about one in ten is discontinued
+def generate_metadata(schema, nstations, rng):
+    latitude = rng.uniform(48.3, 59.9, nstations).round(6)
+    longitude = rng.uniform(-139.0, -114.1, nstations).round(6)
+    active = rng.random(nstations) > 0.1
+    this_year = datetime.today().year
+    if schema == 'hydat':
+        return pd.DataFrame({
+            'STATION_NUMBER': ['08S' + str(i).zfill(5) for i in range(nstations)],
+            'STATION_NAME': synthetic_names(rng, nstations, 'RIVER'),
+            'STATION_STATUS': np.where(active, 'ACTIVE', 'DISCONTINUED'),
+            'DRAINAGE_AREA_GROSS': rng.lognormal(5, 1.5, nstations).round(2),
+            'DRAINAGE_AREA_EFFECT': np.nan,
+            'RHBN': rng.integers(0, 2, nstations).astype(str),
+            'REAL_TIME': rng.integers(0, 2, nstations).astype(str),
+            'LATITUDE': latitude,
+            'LONGITUDE': longitude,
+            'DATUM_ID': np.where(rng.random(nstations) > 0.5, 10.0, np.nan)
+        })
+    elif schema == 'ecclimate':
+        first_year = rng.integers(1900, 2000, nstations)
+        last_year = np.where(active, this_year, rng.integers(2000, this_year - 1, nstations))
+        return pd.DataFrame({
+            'Name': synthetic_names(rng, nstations, 'CLIMATE'),
+            'Province': 'BRITISH COLUMBIA',
+            'Climate ID': [str(1000000 + i) for i in range(nstations)],
+            'Station ID': [str(100000 + i) for i in range(nstations)],
+            'WMO ID': '',
+            'TC ID': '',
+            'Latitude (Decimal Degrees)': latitude,
+            'Longitude (Decimal Degrees)': longitude,
+            'Latitude': (latitude * 1e7).round(),
+            'Longitude': (longitude * 1e7).round(),
+            'Elevation (m)': rng.uniform(0, 2500, nstations).round(1),
+            'First Year': first_year,
+            'Last Year': last_year,
+            'HLY First Year': np.nan,
+            'HLY Last Year': np.nan,
+            'DLY First Year': first_year.astype('float64'),
+            'DLY Last Year': last_year.astype('float64'),
+            'MLY First Year': first_year.astype('float64'),
+            'MLY Last Year': np.minimum(last_year, 2007).astype('float64')
+        })
+    elif schema == 'pacfish':
+        end_date = np.where(active, pd.Timestamp(datetime.today().date()), pd.Timestamp(this_year - 3, 1, 1))
+        return pd.DataFrame({
+            'station_id': [str(i + 1) for i in range(nstations)],
+            'station_name': synthetic_names(rng, nstations, 'CREEK'),
+            'station_url_name': ['synthetic-creek-' + str(i) for i in range(nstations)],
+            'start_date': pd.Timestamp(2015, 1, 1),
+            'end_date': pd.to_datetime(end_date),
+            'water_temperature': True,
+            'staff_gauge': rng.random(nstations) > 0.5,
+            'voltage': False,
+            'barometric_pressure': True,
+            'lat': latitude,
+            'long': longitude,
+            'site_info': ''
+        })
+    raise ValueError('Unsupported schema: ' + str(schema))
+
+# Generates the daily data table for a schema, with one row per station and day for the ndays up to end_date, and the columns of the files exported by the gather scripts. Values follow a seasonal cycle with noise, and a few are missing
+def generate_daily(schema, metadata, ndays, end_date, rng):
+    config = POST_CONFIGS[schema]['postd2w']
+    stations = metadata[config['metadata_statcol']].to_numpy()
+    dates = pd.date_range(end=pd.to_datetime(end_date).normalize(), periods=ndays)
+    nrows = len(stations) * ndays
+    statcol = np.repeat(stations, ndays)
+    datecol = np.tile(dates.strftime('%Y-%m-%d').to_numpy(), len(stations))
+    season = np.tile(np.sin(2 * np.pi * dates.dayofyear.to_numpy() / 365.25), len(stations))
+
+    # Random values around a seasonal cycle, rounded as they are stored in the databases, with about 2% missing
+    def series(mean, amplitude, noise, digits=3, missing=0.02):
+        values = (mean + amplitude * season + rng.normal(0, noise, nrows)).round(digits)
+        values[rng.random(nrows) < missing] = np.nan
+        return values
+
+    # Climate flags are mostly empty
+    def flags():
+        return np.where(rng.random(nrows) < 0.05, rng.choice(np.array(['E', 'M', 'T']), nrows), '')
+
+    if schema == 'hydat':
+        return pd.DataFrame({
+            'STATION_NUMBER': statcol,
+            'Date': datecol,
+            'flow': np.abs(series(50, 40, 10)),
+            'level': series(2, 1, 0.2),
+            'pub_status': np.where(rng.random(nrows) > 0.2, 'True', 'False')
+        })
+    elif schema == 'ecclimate':
+        names = metadata.set_index('Station ID')['Name']
+        max_temp = series(12, 12, 3, 1)
+        min_temp = (max_temp - np.abs(rng.normal(8, 2, nrows))).round(1)
+        mean_temp = ((max_temp + min_temp) / 2).round(1)
+        rain = np.where(rng.random(nrows) < 0.4, rng.exponential(6, nrows), 0).round(1)
+        snow = np.where(mean_temp < 0, rng.exponential(3, nrows), 0).round(1)
+        return pd.DataFrame({
+            'ec_station_id': statcol,
+            'station_name': names.loc[statcol].to_numpy(),
+            'datetime': datecol,
+            'max_temp': max_temp,
+            'max_temp_flag': flags(),
+            'min_temp': min_temp,
+            'min_temp_flag': flags(),
+            'mean_temp': mean_temp,
+            'mean_temp_flag': flags(),
+            'heat_deg_days': np.maximum(18 - mean_temp, 0).round(1),
+            'heat_deg_days_flag': flags(),
+            'cool_deg_days': np.maximum(mean_temp - 18, 0).round(1),
+            'cool_deg_days_flag': flags(),
+            'total_rain': rain,
+            'total_rain_flag': flags(),
+            'total_snow': snow,
+            'total_snow_flag': flags(),
+            'total_precip': (rain + snow).round(1),
+            'total_precip_flag': flags(),
+            'snow_on_grnd': np.where(mean_temp < 0, rng.integers(0, 100, nrows), 0).astype('float64'),
+            'snow_on_grnd_flag': flags(),
+            'dir_of_max_gust': np.where(rng.random(nrows) < 0.3, rng.integers(1, 37, nrows), np.nan),
+            'dir_of_max_gust_flag': flags(),
+            'spd_of_max_gust': np.where(rng.random(nrows) < 0.3, rng.integers(31, 100, nrows), np.nan),
+            'spd_of_max_gust_flag': flags()
+        })
+    elif schema == 'pacfish':
+        names = metadata.set_index('station_id')['station_name']
+        return pd.DataFrame({
+            'station_number': statcol,
+            'station_name': names.loc[statcol].to_numpy(),
+            'datetime': datecol,
+            'pressure': series(10.3, 0.2, 0.05),
+            'sensor_depth': series(0.5, 0.3, 0.05),
+            'water_level': series(0.8, 0.3, 0.05),
+            'water_temperature': series(9, 6, 1, 2)
+        })
+    raise ValueError('Unsupported schema: ' + str(schema))
+
+# Generates and writes a schema's synthetic metadata and daily data to csv files in a directory, in the same form as the gather scripts export them. Returns the paths of the metadata and daily files, as a tuple
+def write_synthetic_data(data_dir, schema, nstations, ndays, end_date=None, seed=0):
+    if not os.path.exists(data_dir):
+        os.makedirs(data_dir)
+    # A separate generator for each schema, so that each one's data is the same whichever schemas are generated
+    rng = np.random.default_rng([seed, SCHEMAS.index(schema)])
+    end_date = end_date or datetime.today().strftime('%Y-%m-%d')
+    (metadata_path, daily_path) = synthetic_paths(data_dir, schema)
+    metadata = generate_metadata(schema, nstations, rng)
+    metadata.to_csv(metadata_path, index=False)
+    # Writing the daily data a block of stations at a time, to bound memory use at large scales
+    block = max(1, 2000000 // max(1, ndays))
+    for start in range(0, nstations, block):
+        daily = generate_daily(schema, metadata.iloc[start:start + block], ndays, end_date, rng)
+        daily.to_csv(daily_path, index=False, mode='w' if start == 0 else 'a', header=start == 0)
+    return (metadata_path, daily_path)
+
+# Builds the state of a d2w server for a schema from its (loaded) posting data, so that a benchmark run exercises every path: a fraction of stations already exist on the server, and for those stations a fraction of the daily rows already exist, of which a fraction have different values than the new data. Returns the list of server stations and the list of server records, both as the server returns them
+def synthetic_server_state(postd2w, owner, existing_stations=0.9, existing_rows=0.5, changed_rows=0.1, seed=0):
+    rng = np.random.default_rng([seed, SCHEMAS.index(postd2w.schema), 1])
+    config = POST_CONFIGS[postd2w.schema]
+    local_stations = config['local_stations'](postd2w)
+    onserver = local_stations[rng.random(local_stations.shape[0]) < existing_stations]
+
+    # Stations, with their server IDs
+    stations = []
+    for i, (stat, row) in enumerate(onserver.iterrows()):
+        stations.append({
+            'id': i + 1,
+            'station_id': stat,
+            'owner': owner,
+            'monitoring_type': postd2w.monitoring_type,
+            'location_name': row['location_name'],
+            'monitoring_status': row['monitoring_status'],
+            'latitude': float(row['latitude']),
+            'longitude': float(row['longitude']),
+            'prov_terr_state_lc': 'BC'
+        })
+    station_info = {station['station_id']: station for station in stations}
+
+    # Existing rows for the stations on the server. Changed rows have their first value column shifted
+    postdf = postd2w.postdf
+    rows = postdf[postdf[postd2w.postdf_statcol].isin(station_info.keys()) & (rng.random(postdf.shape[0]) < existing_rows)].copy()
+    valuecols = [col for key, col in postd2w.ps_col_mappings.items() if key not in ['station_id', 'datetime', 'location_name'] and pd.api.types.is_float_dtype(rows[col])]
+    changed = rng.random(rows.shape[0]) < changed_rows
+    rows.loc[changed, valuecols[0]] = rows.loc[changed, valuecols[0]].fillna(0) + 1
+    rows[postd2w.postdf_datecol] = rows[postd2w.postdf_datecol].dt.strftime('%Y-%m-%d')
+    # Missing values are returned by the server as None
+    rows = rows.astype(object).where(rows.notna(), None)
+
+    # Server records, in the nested form returned by data queries
+    fields = {key: col for key, col in postd2w.ps_col_mappings.items() if key not in ['station_id', 'location_name']}
+    records = []
+    for i, row in enumerate(rows.to_dict('records')):
+        station = station_info[row[postd2w.postdf_statcol]]
+        record = {key: row[col] for key, col in fields.items()}
+        record['id'] = i + 1
+        record['station'] = {'id': station['id'], 'station_id': station['station_id'], 'location_name': station['location_name']}
+        records.append(record)
+    return (stations, records)
+
+# Checks that a bulk fetch of server data (see get_server_data_bulk) returns exactly the owner's records within a date window. A station of another owner is first added to the fake server, with a record on each day of the window, so that the check fails if other owners' data is fetched. Returns the number of records fetched, or raises a RuntimeError
+def check_bulk_fetch(server, monitoring_type, owner, start_date, end_date):
+    dates = pd.date_range(pd.to_datetime(start_date).date(), pd.to_datetime(end_date).date()).strftime('%Y-%m-%d')
+    other = {'id': max(server.stations.keys(), default=0) + 1, 'station_id': 'OTHER-OWNER', 'owner': str(owner) + '-other', 'location_name': 'OTHER OWNER STATION'}
+    records = [{'id': server.next_record_id + i, 'datetime': date, 'station': {'id': other['id'], 'station_id': other['station_id'], 'location_name': other['location_name']}} for i, date in enumerate(dates)]
+    server.load(monitoring_type, [other], records)
+
+    # The owner's records expected within the window, by station
+    with server.lock:
+        owned = [station['station_id'] for station in server.stations.values() if str(station.get('owner')) == str(owner) and station.get('monitoring_type') == monitoring_type]
+        expected = {stat: sum(1 for date in server.dates.get(monitoring_type, dict()).get(stat, []) if dates[0] <= date <= dates[-1]) for stat in owned}
+
+    with redirect_stdout(io.StringIO()):
+        fetched = get_server_data_bulk(FakeD2WClient(server.url, monitoring_type), monitoring_type, owner, owned + [other['station_id']], start_date, end_date)
+    if len(fetched[other['station_id']]) > 0:
+        raise RuntimeError('Bulk fetch returned ' + str(len(fetched[other['station_id']])) + " records of another owner's station")
+    wrong = [stat for stat in owned if len(fetched[stat]) != expected[stat]]
+    if len(wrong) > 0:
+        raise RuntimeError('Bulk fetch returned the wrong number of records for ' + str(len(wrong)) + ' stations, e.g ' + wrong[0])
+    return sum(len(fetched[stat]) for stat in owned)
+
+# Gets the current resident memory of the process in bytes, where the platform provides it
+def current_memory_bytes():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+# Gets the peak resident memory of the current process in bytes, where the platform provides it
+def peak_memory_bytes():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if os.uname().sysname == 'Darwin' else peak * 1024
+
+# Runs the same steps as the post_*_d2w.py scripts for a schema against a (fake) d2w server: the posting data is loaded, stations are synced, each station's data is reconciled against the server, and the new data csvs are uploaded. The reconciliation options are those of the scripts. Script output is discarded. Returns the run's results, throughput, memory use and metrics (see RunMetrics) as a dictionary. This is meant to be run in its own process, so that its peak memory is not mixed with other runs
+def run_post_flow(schema, server_url, metadata_path, daily_path, data_temp_path, start_date, end_date, workers=1, bulk_fetch=False, update_batch_size=100, max_in_flight=1, async_requests=None, rate_control=False, upload=True):
+    baseline = current_memory_bytes()
+    config = POST_CONFIGS[schema]
+    metrics = RunMetrics(schema)
+    started = time.perf_counter()
+    with redirect_stdout(io.StringIO()):
+        with metrics.timed('load'):
+            postd2w = PostD2W(metadata_path=metadata_path, postdf_path=daily_path, **config['postd2w'])
+
+        # Client for the fake server, counting every request, with optional rate control
+        client = MeteredClient(FakeD2WClient(server_url, postd2w.monitoring_type), metrics)
+        if rate_control:
+            client = ThrottledClient(client)
+
+        with metrics.timed('station_sync'):
+            sync_stations(client, config['owner_id'], postd2w.monitoring_type, config['local_stations'](postd2w), config['station_mapping'])
+
+        # Reconciling stations, on an event loop or on worker threads
+        with metrics.timed('reconcile'):
+            if async_requests is not None:
+                with AsyncD2WClient(client, max_concurrency=async_requests) as aclient:
+                    results = asyncio.run(reconcile_stations_async(aclient, postd2w, start_date, end_date, data_temp_path, bulk_fetch=bulk_fetch, owner=config['owner_id'], metrics=metrics))
+            else:
+                results = reconcile_stations(client, postd2w, start_date, end_date, data_temp_path, workers=workers, bulk_fetch=bulk_fetch, owner=config['owner_id'], update_batch_size=update_batch_size, max_in_flight=max_in_flight, metrics=metrics)
+
+        # Uploading the new data csvs
+        uploaded = 0
+        if upload:
+            file_mappings = postd2w.ps_col_mappings.copy()
+            file_mappings.update(dict(UPLOAD_CONSTANTS[schema], owner=config['owner_id']))
+            mapping_fn = get_climate_mapping if postd2w.monitoring_type == 'CLIMATE' else get_surface_water_mapping
+            with metrics.timed('upload'):
+                for name in sorted(file for file in os.listdir(data_temp_path) if file.endswith('csv')):
+                    client.post_csv_file(data_temp_path + '/' + name, mapping_fn(file_mappings))
+                    uploaded += 1
+    seconds = time.perf_counter() - started
+
+    peak = peak_memory_bytes()
+    nrows = 0 if postd2w.postdf is None else int(postd2w.postdf.shape[0])
+    report = metrics.report()
+    return {
+        'schema': schema,
+        'rows': nrows,
+        'stations': len(results),
+        'added': report['counters'].get('rows_added', 0),
+        'updated': report['counters'].get('rows_updated', 0),
+        'unchanged': report['counters'].get('rows_unchanged', 0),
+        'failed': report['counters'].get('stations_failed', 0),
+        'uploaded': uploaded,
+        'seconds': seconds,
+        'rows_per_second': nrows / seconds if seconds > 0 else 0.0,
+        'stations_per_second': len(results) / seconds if seconds > 0 else 0.0,
+        'api_calls': sum(endpoint['calls'] for endpoint in report['api'].values()),
+        # Peak memory is reported as the growth over the process's memory when the run started, as a forked process starts out sharing its parent's memory
+        'peak_memory_bytes': peak - baseline if peak is not None and baseline is not None else None,
+        'metrics': report
+    }
+
+# Formats a list of benchmark results as a table for printing
+def format_benchmarks(benchmarks):
+    lines = ['{:<10} {:>9} {:>8} {:>8} {:>8} {:>10} {:>7} {:>9} {:>10} {:>11} {:>9} {:>10}'.format('schema', 'rows', 'stations', 'added', 'updated', 'unchanged', 'failed', 'seconds', 'rows/s', 'stations/s', 'api calls', 'peak MB')]
+    for benchmark in benchmarks:
+        peak = benchmark['peak_memory_bytes']
+        lines.append('{:<10} {:>9} {:>8} {:>8} {:>8} {:>10} {:>7} {:>8.1f}s {:>10.0f} {:>11.1f} {:>9} {:>10}'.format(
+            benchmark['schema'],
+            benchmark['rows'],
+            benchmark['stations'],
+            benchmark['added'],
+            benchmark['updated'],
+            benchmark['unchanged'],
+            benchmark['failed'],
+            benchmark['seconds'],
+            benchmark['rows_per_second'],
+            benchmark['stations_per_second'],
+            benchmark['api_calls'],
+            'n/a' if peak is None else '{:.1f}'.format(peak / 2**20)
+        ))
+    return '\n'.join(lines)
@@ -0,0 +1,69 @@
+# Description: Generates synthetic station metadata and daily data for the hydat, ecclimate and pacfish schemas, in the same form as the files exported by the gather scripts, at a configurable scale (e.g 10000 stations by 365 days). The data is seeded, so the same options always give the same files. Used by run_benchmark.py, which generates the data itself if it is missing
+
+# %% ===== Loading libraries =====
+import os
+import sys
+from pathlib import Path
+os.chdir(Path(__file__).parent.parent.parent)
+sys.path.append(os.getcwd())
+import time
+from optparse import OptionParser
+from scripts.benchmark.benchmark_utils import *
+
+#%% Initializing option parsing
+parser = OptionParser()
+parser.add_option(
+    "--schemas",
+    dest="schemas",
+    default=','.join(SCHEMAS),
+    help="A comma-separated list of the schemas to generate data for. Defaults to " + ','.join(SCHEMAS))
+parser.add_option(
+    "-n", "--stations",
+    dest="stations",
+    type="int",
+    default=1000,
+    help="The number of stations in each schema. Defaults to 1000")
+parser.add_option(
+    "-d", "--days",
+    dest="days",
+    type="int",
+    default=365,
+    help="The number of days of daily data for each station. Defaults to 365")
+parser.add_option(
+    "-e", "--enddate",
+    dest="enddate",
+    default=None,
+    help="The last date of the daily data (YYYY-MM-DD). Defaults to today")
+parser.add_option(
+    "--seed",
+    dest="seed",
+    type="int",
+    default=0,
+    help="The random seed. Defaults to 0")
+parser.add_option(
+    "-o", "--out-dir",
+    dest="out_dir",
+    default="data/benchmark",
+    help="The directory the files are written to. Defaults to data/benchmark")
+(options, args) = parser.parse_args()
+
+# Schemas to generate
+schemas = [schema.strip() for schema in options.schemas.split(',')]
+for schema in schemas:
+    if schema not in SCHEMAS:
+        parser.error('Unsupported schema: ' + schema)
+
+# %% ===== Generating data =====
+for schema in schemas:
+    started = time.time()
+    (metadata_path, daily_path) = write_synthetic_data(options.out_dir, schema, options.stations, options.days, options.enddate, options.seed)
+    print('Generated {} stations by {} days for {} in {:.1f}s: {} ({:.1f} MB)'.format(
+        options.stations,
+        options.days,
+        schema,
+        time.time() - started,
+        daily_path,
+        os.path.getsize(daily_path) / 2**20
+    ))
+
+# %%
@@ -0,0 +1,210 @@
+# Description: Benchmarks the posting flow of each post_*_d2w.py script against a local fake d2w server, using synthetic data, so that performance changes can be measured without touching the production server. For each schema the fake server is loaded with an existing set of stations and data (part of it out of date), and the flow (load, station sync, reconciliation and csv upload) is run in its own process with the same options as the post scripts. The throughput, API calls and peak memory of each flow are printed, and can be written to a JSON report
+
+# %% ===== Loading libraries =====
+import os
+import sys
+from pathlib import Path
+os.chdir(Path(__file__).parent.parent.parent)
+sys.path.append(os.getcwd())
+import json
+import shutil
+from optparse import OptionParser
+from multiprocessing import get_context
+from concurrent.futures import ProcessPoolExecutor
+from scripts.benchmark.benchmark_utils import *
+from scripts.benchmark.FakeD2WServer import FakeD2WServer
+
+#%% Initializing option parsing
+parser = OptionParser()
+parser.add_option(
+    "--schemas",
+    dest="schemas",
+    default=','.join(SCHEMAS),
+    help="A comma-separated list of the schemas to benchmark. Defaults to " + ','.join(SCHEMAS))
+parser.add_option(
+    "--data-dir",
+    dest="data_dir",
+    default="data/benchmark",
+    help="The directory holding the synthetic data (see generate_synthetic_data.py). Data missing from it is generated with the stations, days and seed options. Defaults to data/benchmark")
+parser.add_option(
+    "-n", "--stations",
+    dest="stations",
+    type="int",
+    default=1000,
+    help="The number of stations in each schema, when generating data. Defaults to 1000")
+parser.add_option(
+    "-d", "--days",
+    dest="days",
+    type="int",
+    default=365,
+    help="The number of days of daily data for each station, when generating data. Defaults to 365")
+parser.add_option(
+    "--seed",
+    dest="seed",
+    type="int",
+    default=0,
+    help="The random seed, for generating data and the server state. Defaults to 0")
+parser.add_option(
+    "--latency",
+    dest="latency",
+    type="float",
+    default=0.05,
+    help="The delay added to every request by the fake server, in seconds. Defaults to 0.05")
+parser.add_option(
+    "--jitter",
+    dest="jitter",
+    type="float",
+    default=0.0,
+    help="The maximum random variation of the delay, in seconds. Defaults to 0")
+parser.add_option(
+    "--page-size",
+    dest="page_size",
+    type="int",
+    default=100,
+    help="The number of items in each page of a list returned by the fake server. Defaults to 100")
+parser.add_option(
+    "--error-rate",
+    dest="error_rate",
+    type="float",
+    default=0.0,
+    help="The fraction of requests the fake server throttles with a 503, to exercise rate control. Defaults to 0")
+parser.add_option(
+    "--existing-stations",
+    dest="existing_stations",
+    type="float",
+    default=0.9,
+    help="The fraction of stations already on the fake server (the rest are created). Defaults to 0.9")
+parser.add_option(
+    "--existing-rows",
+    dest="existing_rows",
+    type="float",
+    default=0.5,
+    help="The fraction of daily rows of those stations already on the fake server (the rest are uploaded). Defaults to 0.5")
+parser.add_option(
+    "--changed-rows",
+    dest="changed_rows",
+    type="float",
+    default=0.1,
+    help="The fraction of the existing rows whose values differ from the new data (and are updated). Defaults to 0.1")
+parser.add_option(
+    "-w", "--workers",
+    dest="workers",
+    type="int",
+    default=1,
+    help="The number of stations to reconcile concurrently against the d2w server. Defaults to 1 (sequential)")
+parser.add_option(
+    "-b", "--bulk-fetch",
+    dest="bulk_fetch",
+    action="store_true",
+    default=False,
+    help="Fetch existing server data for all stations in a single windowed query, rather than one query per station")
+parser.add_option(
+    "--batch-size",
+    dest="batch_size",
+    type="int",
+    default=100,
+    help="The number of changed rows queued per batch of update requests. Defaults to 100")
+parser.add_option(
+    "--max-in-flight",
+    dest="max_in_flight",
+    type="int",
+    default=1,
+    help="The maximum number of update requests sent to the d2w server at once. Defaults to 1 (sequential)")
+parser.add_option(
+    "-a", "--async-requests",
+    dest="async_requests",
+    type="int",
+    default=None,
+    help="Reconcile stations on an event loop with up to this many requests in flight to the d2w server at once, rather than on worker threads")
+parser.add_option(
+    "-r", "--rate-control",
+    dest="rate_control",
+    action="store_true",
+    default=False,
+    help="Send all d2w requests through the adaptive rate controller")
+parser.add_option(
+    "--skip-upload",
+    dest="skip_upload",
+    action="store_true",
+    default=False,
+    help="Leave out the upload of new data csvs (which is currently disabled in the post scripts)")
+parser.add_option(
+    "--report",
+    dest="report",
+    default=None,
+    help="Write the results, including the metrics of each run, to this JSON file")
+(options, args) = parser.parse_args()
+
+# Schemas to benchmark
+schemas = [schema.strip() for schema in options.schemas.split(',')]
+for schema in schemas:
+    if schema not in SCHEMAS:
+        parser.error('Unsupported schema: ' + schema)
+
+# %% ===== Running benchmarks =====
+benchmarks = []
+for schema in schemas:
+    # Generating the synthetic data, if it isn't there already
+    (metadata_path, daily_path) = synthetic_paths(options.data_dir, schema)
+    if not os.path.exists(metadata_path) or not os.path.exists(daily_path):
+        print('Generating synthetic data for ' + schema + '...')
+        write_synthetic_data(options.data_dir, schema, options.stations, options.days, seed=options.seed)
+
+    # Loading the data, and building the server's existing state from it
+    config = POST_CONFIGS[schema]
+    postd2w = PostD2W(metadata_path=metadata_path, postdf_path=daily_path, **config['postd2w'])
+    (stations, records) = synthetic_server_state(postd2w, config['owner_id'], options.existing_stations, options.existing_rows, options.changed_rows, options.seed)
+    dates = postd2w.postdf[postd2w.postdf_datecol]
+    start_date = dates.min().strftime("%Y-%m-%dT00:00:00-00:00")
+    end_date = dates.max().strftime("%Y-%m-%dT00:00:00-00:00")
+    del postd2w
+
+    # Clearing posting files left by a previous run
+    data_temp_path = options.data_dir + '/temp/' + schema
+    if os.path.exists(data_temp_path):
+        shutil.rmtree(data_temp_path)
+    os.makedirs(data_temp_path)
+
+    with FakeD2WServer(latency=options.latency, jitter=options.jitter, page_size=options.page_size, error_rate=options.error_rate) as server:
+        server.load(config['postd2w']['monitoring_type'], stations, records)
+        del stations, records
+        print('Benchmarking ' + schema + ' against fake server at ' + server.url + '...')
+
+        # Running the flow in its own (forked) process, so that its peak memory is measured on its own
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context('fork')) as pool:
+            benchmark = pool.submit(
+                run_post_flow,
+                schema=schema,
+                server_url=server.url,
+                metadata_path=metadata_path,
+                daily_path=daily_path,
+                data_temp_path=data_temp_path,
+                start_date=start_date,
+                end_date=end_date,
+                workers=options.workers,
+                bulk_fetch=options.bulk_fetch,
+                update_batch_size=options.batch_size,
+                max_in_flight=options.max_in_flight,
+                async_requests=options.async_requests,
+                rate_control=options.rate_control,
+                upload=not options.skip_upload
+            ).result()
+        benchmark['server_requests'] = dict(server.requests)
+
+        # Checking that a bulk fetch only returns the owner's records, when bulk fetching is benchmarked
+        if options.bulk_fetch:
+            nfetched = check_bulk_fetch(server, config['postd2w']['monitoring_type'], config['owner_id'], start_date, end_date)
+            print('Bulk fetch check passed: ' + str(nfetched) + " records fetched, none of another owner's")
+    benchmarks.append(benchmark)
+    print('Completed {} in {:.1f}s'.format(schema, benchmark['seconds']))
+
+# %% ===== Summarizing the benchmarks =====
+print(format_benchmarks(benchmarks))
+
+if options.report is not None:
+    report = {'options': vars(options), 'benchmarks': benchmarks}
+    with open(options.report, 'w') as f:
+        json.dump(report, f, indent=2)
+    print('Wrote report to ' + options.report)
+
+# %%
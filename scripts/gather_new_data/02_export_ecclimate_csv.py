@@ -13,7 +13,7 @@ from json import load
 from optparse import OptionParser
 from datetime import datetime, timedelta
 import psycopg2
-import pandas as pd
+from scripts.gather_new_data.gather_utils import *
 
 #%% Initializing option parsing
 parser = OptionParser()
@@ -27,6 +27,23 @@ parser.add_option(
     dest="enddate",
     default=datetime.today().strftime("%Y-%m-%dT00:00:00-00:00"),
     help="The end date of the date range for which data are being posted. Defaults to today")
+parser.add_option(
+    "-i", "--incremental", 
+    dest="incremental",
+    action="store_true",
+    default=False,
+    help="Only export rows (within the date range) that were inserted or modified since the last successful incremental run")
+parser.add_option(
+    "-m", "--modified-col", 
+    dest="modified_col",
+    default=None,
+    help="A modification timestamp column used to find changed rows in incremental mode. Defaults to using the xmin system column")
+parser.add_option(
+    "-f", "--format", 
+    dest="format",
+    default="csv",
+    choices=["csv", "parquet"],
+    help="The file format of the exported data, either csv or parquet (typed and compressed). Defaults to csv")
 (options, args) = parser.parse_args()
 
 # %% ===== Paths and global variables =====
@@ -37,6 +54,9 @@ creds = load(open('options/dbase_credentials.json',))
 # Filepaths
 fpaths = load(open('options/filepaths.json', ))
 
+# Path to the file storing the watermarks of incremental runs
+watermark_path = fpaths['temp-dir'] + '/watermarks.json'
+
 # Ensuring directory exists for holding posting data data
 out_dir = fpaths['update-data-dir']
 if not os.path.exists(out_dir):
@@ -64,29 +84,26 @@ end_date = options.enddate
 
 # Query options
 schema = 'ecclimate'
-table = 'daily'
-datecol = 'datetime'
-# Building query
-query = 'select * from {0}.{1} where "{2}" >= \'{3}\' and "{2}" <= \'{4}\''.format(
-    schema,
-    table,
-    datecol,
-    start_date,
-    end_date
-)
-
-# Getting data
-cursor.execute(query)
-col_names = [i[0] for i in cursor.description]
-daily = pd.DataFrame(cursor.fetchall(), columns=col_names)
 
+# Getting the watermark for this run, and (in incremental mode) a condition selecting only rows changed since the last run
+run_watermark = current_watermark(cursor, options.modified_col)
+changed_filter = modified_since(load_watermark(watermark_path, schema, options.modified_col), run_watermark, options.modified_col) if options.incremental else 'true'
 
-# %%  ==== Exporting to CSV ====
-if daily.shape[0] == 0:
-    print("No new data available for EC-Climate between {} and {}. No CSV exported".format(start_date, end_date))
-else:
-    print("Exporting data to CSV")
-    daily.to_csv(out_dir + '/ecclimate-daily.csv', index=False)
+# %%  ==== Exporting to file ====
 
+# Streaming the query results straight to the output file - either directly as csv, or in chunks to parquet
+print("Exporting data to " + options.format)
+outpath = out_dir + '/ecclimate-daily.' + options.format
+nrows = export_daily(conn, 'ecclimate', start_date, end_date, outpath, options.format, changed_filter)
+if nrows == 0:
+    print("No new data available for EC-Climate between {} and {}. No file exported".format(start_date, end_date))
+    # In incremental mode, removing the previous run's export so that it isn't mistaken for new changes
+    if options.incremental and os.path.exists(outpath):
+        os.remove(outpath)
 
+# %% ==== Saving the watermark for the next incremental run ====
+# The watermark stays pending until the export has been posted (see post_ecclimate_d2w.py), so that the next incremental export still includes these rows if posting fails. The exported file is saved with it, so that the watermark is only committed by a post of that file
+if options.incremental:
+    save_pending_watermark(watermark_path, schema, run_watermark, options.modified_col, outpath, options.format, nrows)
 
+# %%
@@ -0,0 +1,59 @@
+from contextlib import contextmanager
+from threading import BoundedSemaphore
+from psycopg2.pool import ThreadedConnectionPool
+
+class ConnectionPool:
+    def __init__(self, creds, maxconn=4):
+        # Setting attributes
+        self.host = creds['host']
+        self.dbname = creds['dbname']
+        self.maxconn = max(1, maxconn)
+
+        # Opening a thread-safe pool of database connections. Connections are only opened when first needed, up to the maximum
+        self.pool = ThreadedConnectionPool(
+            0,
+            self.maxconn,
+            host=creds['host'],
+            port=creds['port'],
+            database=creds['dbname'],
+            user=creds['user'],
+            password=creds['password']
+        )
+
+        # The pool raises an error rather than waiting when all connections are in use, so callers wait for a free connection here instead
+        self.available = BoundedSemaphore(self.maxconn)
+
+    def __str__(self):
+        outstr = "Postgres connection pool for database: " + self.dbname + ' on ' + self.host + '\n' + 'Maximum connections: ' + str(self.maxconn)
+        return(outstr)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # Borrows a connection from the pool for the duration of a with block, waiting for one to be free if necessary. Any transaction left open is rolled back before the connection is returned, and connections that have broken are discarded
+    @contextmanager
+    def connection(self):
+        self.available.acquire()
+        try:
+            conn = self.pool.getconn()
+            try:
+                yield conn
+            finally:
+                try:
+                    conn.rollback()
+                    self.pool.putconn(conn)
+                except Exception:
+                    self.pool.putconn(conn, close=True)
+        finally:
+            self.available.release()
+
+    # Runs a function on a pooled connection, passing the connection as the first argument
+    def run(self, fn, *args, **kwargs):
+        with self.connection() as conn:
+            return fn(conn, *args, **kwargs)
+
+    def close(self):
+        self.pool.closeall()
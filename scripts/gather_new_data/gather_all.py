@@ -0,0 +1,149 @@
+# Description: Exports station metadata and daily data for all databases at once, running every export concurrently on a shared pool of database connections. This replaces running 01_get_station_files.py and each of the 02_export scripts one after another, so that the gather stage takes about as long as its slowest export
+
+# %% ===== Loading libraries =====
+import os
+import sys
+from pathlib import Path
+os.chdir(Path(__file__).parent.parent.parent)
+sys.path.append(os.getcwd())
+import time
+from json import load
+from optparse import OptionParser
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from scripts.gather_new_data.gather_utils import *
+from scripts.gather_new_data.ConnectionPool import ConnectionPool
+
+#%% Initializing option parsing
+parser = OptionParser()
+parser.add_option(
+    "-s", "--startdate",
+    dest="startdate",
+    default=(datetime.today() - timedelta(days=31)).strftime("%Y-%m-%dT00:00:00-00:00"),
+    help="The start date of the date range for which data are being posted. Defaults to 31 days before today")
+parser.add_option(
+    "-e", "--enddate",
+    dest="enddate",
+    default=datetime.today().strftime("%Y-%m-%dT00:00:00-00:00"),
+    help="The end date of the date range for which data are being posted. Defaults to today")
+parser.add_option(
+    "-i", "--incremental",
+    dest="incremental",
+    action="store_true",
+    default=False,
+    help="Only export rows (within the date range) that were inserted or modified since the last successful incremental run")
+parser.add_option(
+    "-m", "--modified-col",
+    dest="modified_col",
+    default=None,
+    help="A modification timestamp column used to find changed rows in incremental mode. Defaults to using the xmin system column")
+parser.add_option(
+    "-c", "--chunksize",
+    dest="chunksize",
+    type="int",
+    default=None,
+    help="Read the Pacfish data in chunks of this many rows on a server-side cursor, to bound memory use. Defaults to reading all data at once")
+parser.add_option(
+    "-f", "--format",
+    dest="format",
+    default="csv",
+    choices=["csv", "parquet"],
+    help="The file format of the exported daily data, either csv or parquet (typed and compressed). Defaults to csv")
+parser.add_option(
+    "--connections",
+    dest="connections",
+    type="int",
+    default=6,
+    help="The maximum number of database connections (and so exports) used at once. Defaults to 6, enough to run every export at once")
+(options, args) = parser.parse_args()
+
+# %% ===== Paths and global variables =====
+
+# Client credentials from JSON
+creds = load(open('options/dbase_credentials.json',))
+
+# Filepaths
+fpaths = load(open('options/filepaths.json', ))
+
+# Path to the file storing the watermarks of incremental runs
+watermark_path = fpaths['temp-dir'] + '/watermarks.json'
+
+# Ensuring directory exists for holding posting data data
+out_dir = fpaths['update-data-dir']
+if not os.path.exists(out_dir):
+    os.makedirs(out_dir)
+
+# Databases to export, and the names their incremental watermarks are saved under
+schemas = WATERMARK_KEYS
+
+# %% ===== Initializing database connection pool =====
+pool = ConnectionPool(creds, maxconn=options.connections)
+
+# %% ===== Initializing update options =====
+start_date = options.startdate
+end_date = options.enddate
+
+# Getting the watermark for this run (shared by all databases), and (in incremental mode) a condition for each database selecting only rows changed since its last run
+run_watermark = pool.run(lambda conn: current_watermark(conn.cursor(), options.modified_col))
+changed_filters = {schema: 'true' for schema in schemas}
+if options.incremental:
+    changed_filters = {schema: modified_since(load_watermark(watermark_path, key, options.modified_col), run_watermark, options.modified_col) for schema, key in schemas.items()}
+
+# %% ==== Running all exports ====
+
+# Times an export on a pooled connection, returning its result and run time
+def timed_export(export_fn, *args):
+    started = time.time()
+    result = pool.run(export_fn, *args)
+    return (result, time.time() - started)
+
+started = time.time()
+with ThreadPoolExecutor(max_workers=pool.maxconn) as executor:
+    metadata_futures = {schema: executor.submit(timed_export, export_metadata, schema, fpaths[schema + '-metadata']) for schema in schemas}
+    daily_futures = {schema: executor.submit(
+        timed_export,
+        export_daily,
+        schema,
+        start_date,
+        end_date,
+        out_dir + '/' + schema + '-daily.' + options.format,
+        options.format,
+        changed_filters[schema],
+        options.chunksize if schema == 'pacfish' else None
+    ) for schema in schemas}
+
+    # Reporting on each export as it is collected. Failed exports are reported without stopping the others
+    failed = []
+    for schema in schemas:
+        for kind, futures in [('metadata', metadata_futures), ('daily data', daily_futures)]:
+            try:
+                (result, seconds) = futures[schema].result()
+                print('Exported {} {} in {:.1f}s'.format(schema, kind, seconds))
+            except Exception as e:
+                print('Error exporting {} {}: {}'.format(schema, kind, repr(e)))
+                failed.append((schema, kind))
+print('Completed all exports in {:.1f}s'.format(time.time() - started))
+
+# %% ==== Handling empty exports and saving watermarks ====
+for schema, key in schemas.items():
+    if (schema, 'daily data') in failed:
+        continue
+    (nrows, seconds) = daily_futures[schema].result()
+    outpath = out_dir + '/' + schema + '-daily.' + options.format
+    if nrows == 0:
+        print("No new data available for {} between {} and {}. No file exported".format(schema, start_date, end_date))
+        # In incremental mode, removing the previous run's export so that it isn't mistaken for new changes
+        if options.incremental and os.path.exists(outpath):
+            os.remove(outpath)
+    # Watermarks are saved one at a time, after all exports are complete, as they share a file. They stay pending until each export has been posted, and are not saved at all if any of the database's exports failed
+    if options.incremental and (schema, 'metadata') not in failed:
+        save_pending_watermark(watermark_path, key, run_watermark, options.modified_col, outpath, options.format, nrows)
+
+# %% Closing connections
+pool.close()
+
+# Exiting with an error status if any export failed
+if len(failed) > 0:
+    sys.exit(1)
+
+# %%
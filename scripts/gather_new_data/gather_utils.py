@@ -0,0 +1,386 @@
+import os
+import csv
+from json import load, dump
+from datetime import datetime
+import pandas as pd
+
+# Names the incremental watermark of each database is saved under
+WATERMARK_KEYS = {
+    'hydat': 'bchydat',
+    'ecclimate': 'ecclimate',
+    'pacfish': 'pacfish'
+}
+
+# Reads the JSON file of watermarks, returning an empty dictionary if there is none
+def read_watermarks(fpath):
+    if not os.path.exists(fpath):
+        return dict()
+    return load(open(fpath, ))
+
+# Writes the JSON file of watermarks, replacing the previous file only once the new one is complete
+def write_watermarks(fpath, watermarks):
+    if os.path.dirname(fpath) != '' and not os.path.exists(os.path.dirname(fpath)):
+        os.makedirs(os.path.dirname(fpath))
+    with open(fpath + '.part', 'w') as f:
+        dump(watermarks, f, indent=2)
+    os.replace(fpath + '.part', fpath)
+
+# Loads the committed watermark for a schema from a JSON file of watermarks (see commit_watermark), returning None if there is none (or if it was saved using a different modification column)
+def load_watermark(fpath, schema, modified_col=None):
+    saved = read_watermarks(fpath).get(schema, dict())
+    if saved.get('watermark') is None or saved.get('modified_col') != modified_col:
+        return None
+    return saved['watermark']
+
+# Saves the watermark of an incremental export for a schema as pending, keeping those of other schemas, along with the path, format and row count of the exported file. A pending watermark is only committed once the export has been posted, so until then every incremental export selects all rows changed since the last posted one. An export that is never posted is therefore included in the next one, rather than being lost when its file is replaced
+def save_pending_watermark(fpath, schema, watermark, modified_col=None, export_path=None, export_format=None, nrows=0):
+    watermarks = read_watermarks(fpath)
+    watermarks.setdefault(schema, dict())['pending'] = {
+        'watermark': watermark,
+        'modified_col': modified_col,
+        'saved_at': datetime.now().isoformat(),
+        'export': {
+            'path': None if export_path is None else os.path.abspath(export_path),
+            'format': export_format,
+            'rows': int(nrows)
+        }
+    }
+    write_watermarks(fpath, watermarks)
+
+# Commits the pending watermark for a schema, once its export has been posted successfully, so that the next incremental export only selects rows changed since it. The watermark is only committed if the posted data was loaded from the exported file (loaded_path), or if the export was recorded as empty - a post that failed to read the export, or read a different file (e.g in another format), keeps the previous watermark so that the export's rows are selected again. Returns whether the watermark was committed
+def commit_watermark(fpath, schema, loaded_path=None):
+    watermarks = read_watermarks(fpath)
+    saved = watermarks.get(schema, dict())
+    pending = saved.get('pending')
+    if pending is None:
+        return False
+    export = pending.get('export')
+    if export is None:
+        print('The pending incremental export watermark does not record its export. Keeping the previous incremental export watermark')
+        return False
+    if export['rows'] > 0 and (loaded_path is None or os.path.abspath(loaded_path) != export['path']):
+        print('The posted data was not loaded from the pending incremental export ({}). Keeping the previous incremental export watermark'.format(export['path']))
+        return False
+    saved.update(saved.pop('pending'))
+    write_watermarks(fpath, watermarks)
+    return True
+
+# Gets the watermark for the current run. If a modification timestamp column is used, this is the database's current time. Otherwise this is the oldest transaction ID still running, so that rows written by any transaction that commits after this run starts are picked up next time
+def current_watermark(cursor, modified_col=None):
+    if modified_col is None:
+        cursor.execute('select txid_snapshot_xmin(txid_current_snapshot())')
+    else:
+        cursor.execute('select now()::text')
+    return cursor.fetchone()[0]
+
+# Builds an SQL condition that selects rows inserted or modified since a watermark. Without a modification timestamp column, this compares against the xmin system column (the 32-bit ID of the transaction that last wrote each row). If there is no watermark, or transaction IDs have wrapped around since it was saved, all rows are selected
+def modified_since(watermark, current, modified_col=None):
+    if watermark is None:
+        return 'true'
+    if modified_col is not None:
+        return "\"{0}\" >= '{1}'".format(modified_col, watermark)
+    if int(watermark) // 2**32 != int(current) // 2**32:
+        return 'true'
+    return "xmin::text::bigint >= {0}".format(int(watermark) % 2**32)
+
+# Streams the results of a query straight into a csv file using postgres' COPY, without passing the data through python objects. Data is written to a partial file that only replaces the target once complete, and nothing is written if the query returns no rows. Returns the number of rows exported
+def copy_query_to_csv(cursor, query, fpath):
+    partpath = fpath + '.part'
+    with open(partpath, 'w', newline='') as f:
+        cursor.copy_expert('COPY ({0}) TO STDOUT WITH CSV HEADER'.format(query), f)
+    # Counting the records written after the header line (parsed as csv, as quoted values may span lines)
+    with open(partpath, 'r', newline='') as f:
+        nrows = max(sum(1 for row in csv.reader(f)) - 1, 0)
+    if nrows > 0:
+        os.replace(partpath, fpath)
+    else:
+        os.remove(partpath)
+    return nrows
+
+# Generator that runs a query on a named (server-side) cursor and yields the results as dataframes of about itersize rows, so that only one chunk is held in memory at a time. If a key column is given, the query must be ordered by it, and rows sharing a key value are never split across chunks
+def iter_query_chunks(conn, query, itersize=100000, keycol=None):
+    with conn.cursor(name='gather_chunks') as cursor:
+        cursor.itersize = itersize
+        cursor.execute(query)
+        carry = None
+        while True:
+            rows = cursor.fetchmany(itersize)
+            if len(rows) == 0: break
+            chunk = pd.DataFrame(rows, columns=[col[0] for col in cursor.description])
+            if carry is not None:
+                chunk = pd.concat([carry, chunk], ignore_index=True)
+                carry = None
+            # Holding back the rows of the last key, as they may continue in the next chunk
+            if keycol is not None:
+                islast = chunk[keycol] == chunk[keycol].iloc[-1]
+                carry = chunk[islast]
+                chunk = chunk[~islast]
+            if chunk.shape[0] > 0:
+                yield chunk
+        if carry is not None and carry.shape[0] > 0:
+            yield carry
+
+# Postgres type OIDs of the columns stored as numbers, booleans and datetimes in typed columnar files. Columns of any other type are stored as strings
+POSTGRES_FLOAT_TYPES = [700, 701, 1700]
+POSTGRES_INT_TYPES = [20, 21, 23]
+POSTGRES_BOOL_TYPES = [16]
+POSTGRES_DATETIME_TYPES = [1082, 1114]
+POSTGRES_DATETIME_TZ_TYPES = [1184]
+
+# Gets the arrow type a postgres column is stored as in a typed columnar file, from its type OID. Numeric (decimal) columns are stored as floats
+def postgres_arrow_type(type_code):
+    # Imported here, as pyarrow is only needed when exporting to parquet
+    import pyarrow as pa
+    if type_code in POSTGRES_FLOAT_TYPES:
+        return pa.float64()
+    elif type_code in POSTGRES_INT_TYPES:
+        return pa.int64()
+    elif type_code in POSTGRES_BOOL_TYPES:
+        return pa.bool_()
+    elif type_code in POSTGRES_DATETIME_TYPES:
+        return pa.timestamp('ns')
+    elif type_code in POSTGRES_DATETIME_TZ_TYPES:
+        return pa.timestamp('ns', tz='UTC')
+    return pa.string()
+
+# Gets the arrow schema of a query's results from the column types reported by the database, without reading any rows
+def query_arrow_schema(cursor, query):
+    import pyarrow as pa
+    cursor.execute('select * from ({0}) as dat limit 0'.format(query))
+    return pa.schema([(col[0], postgres_arrow_type(col[1])) for col in cursor.description])
+
+# Gets the arrow schema of reshaped Pacfish daily data (see reshape_pacfish_daily), from the column types of the Pacfish daily query and the list of parameter columns
+def pacfish_arrow_schema(cursor, query, paramcols):
+    import pyarrow as pa
+    raw = query_arrow_schema(cursor, query)
+    (statcol, namecol, dtcol, valcol) = [name for name in raw.names if name not in ['numObservations', 'Parameter']]
+    return pa.schema([
+        ('station_number', raw.field(statcol).type),
+        ('station_name', raw.field(namecol).type),
+        ('datetime', raw.field(dtcol).type)
+    ] + [(param, raw.field(valcol).type) for param in paramcols])
+
+# Gets an arrow schema from a dictionary of pandas column types, as used for the posting data (see PostD2W)
+def dtypes_arrow_schema(dtypes):
+    import pyarrow as pa
+    types = {'str': pa.string(), 'float64': pa.float64(), 'int64': pa.int64(), 'bool': pa.bool_(), 'datetime64': pa.timestamp('ns')}
+    return pa.schema([(col, types[dtype]) for col, dtype in dtypes.items()])
+
+# Converts a dataframe of query results to the column types of an arrow schema, so that every chunk of a file is stored with the same types whatever values it holds (e.g a numeric column that is all null in one chunk): decimals become floats, dates become datetimes, and string columns keep missing values as nulls. Columns missing from the dataframe are added as nulls, and columns not in the schema are left out. Returns an arrow table
+def to_interchange_table(df, schema):
+    import pyarrow as pa
+    df = df.reindex(columns=schema.names)
+    for field in schema:
+        if pa.types.is_floating(field.type):
+            df[field.name] = pd.to_numeric(df[field.name]).astype('float64')
+        elif pa.types.is_integer(field.type):
+            df[field.name] = pd.to_numeric(df[field.name]).astype('Int64')
+        elif pa.types.is_boolean(field.type):
+            df[field.name] = df[field.name].astype('boolean')
+        elif pa.types.is_timestamp(field.type):
+            df[field.name] = pd.to_datetime(df[field.name], utc=field.type.tz is not None)
+        else:
+            df[field.name] = df[field.name].astype('string')
+    return pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+
+# Writes an iterable of dataframe chunks to a single compressed parquet file, with every chunk stored using the given arrow schema. Data is written to a partial file that only replaces the target once complete, and nothing is written if there are no rows. Returns the number of rows exported
+def write_parquet(chunks, fpath, schema, compression='zstd'):
+    import pyarrow.parquet as pq
+    partpath = fpath + '.part'
+    writer = None
+    nrows = 0
+    for chunk in chunks:
+        table = to_interchange_table(chunk, schema)
+        if writer is None:
+            writer = pq.ParquetWriter(partpath, schema, compression=compression)
+        writer.write_table(table)
+        nrows += table.num_rows
+    if writer is not None:
+        writer.close()
+    if nrows > 0:
+        os.replace(partpath, fpath)
+    elif os.path.exists(partpath):
+        os.remove(partpath)
+    return nrows
+
+# Writes an iterable of dataframe chunks to a single csv file, in the same way as write_parquet. Returns the number of rows exported
+def write_csv(chunks, fpath):
+    partpath = fpath + '.part'
+    nrows = 0
+    for chunk in chunks:
+        if chunk.shape[0] == 0: continue
+        chunk.to_csv(partpath, mode='w' if nrows == 0 else 'a', header=(nrows == 0), index=False)
+        nrows += chunk.shape[0]
+    if nrows > 0:
+        os.replace(partpath, fpath)
+    return nrows
+
+# Runs a query and reads the full result into a dataframe
+def query_to_df(cursor, query):
+    cursor.execute(query)
+    col_names = [i[0] for i in cursor.description]
+    return pd.DataFrame(cursor.fetchall(), columns=col_names)
+
+# Gets the Pacfish station metadata, removing stations with missing location data
+def get_pacfish_metadata(cursor):
+    pacfish = query_to_df(cursor, "select * from pacfish.station_metadata")
+    return pacfish.dropna(subset=['long', 'lat'])
+
+# Gets the EC Climate station metadata, ensuring the station ID column is a string
+def get_ecclimate_metadata(cursor):
+    ecclimate = query_to_df(cursor, "select * from ecclimate.station_metadata")
+    ecclimate.loc[:,'Station ID'] = pd.to_numeric(ecclimate['Station ID'], downcast='integer').astype(str)
+    return ecclimate
+
+# Gets the Hydat station metadata, subset to the relevant columns, with station status edited to either be active or discontinued
+def get_hydat_metadata(cursor):
+    hydat = query_to_df(cursor, "select * from bchydat.station_metadata")
+    # List of only relevant columns
+    collist = ['STATION_NUMBER', 'STATION_NAME', 'STATION_STATUS', 'DRAINAGE_AREA_GROSS', 'DRAINAGE_AREA_EFFECT','RHBN', 'REAL_TIME','LONGITUDE', 'LATITUDE', 'DATUM_ID']
+    hydat = hydat.rename(columns={'HYD_STATUS':'STATION_STATUS'})[collist]
+    hydat['STATION_STATUS'] = ['ACTIVE' if status == 'ACTIVE-REALTIME' else status for status in hydat['STATION_STATUS']]
+    return hydat
+
+# Builds the query for EC Climate daily data within a date range, restricted to rows matching a changed-rows condition (see modified_since)
+def get_ecclimate_daily_query(start_date, end_date, changed_filter='true'):
+    return 'select * from {0}.{1} where "{2}" >= \'{3}\' and "{2}" <= \'{4}\' and {5}'.format(
+        'ecclimate',
+        'daily',
+        'datetime',
+        start_date,
+        end_date,
+        changed_filter
+    )
+
+# Builds the query for Hydat daily data within a date range, full joining flow and level to a single table by station and date. Pub-status is taken from flow if present, otherwise from level, and written as True/False (rather than postgres' t/f) to match the posting scripts
+def get_hydat_daily_query(start_date, end_date, changed_filter='true'):
+    schema = 'bchydat'
+    datecol = 'Date'
+
+    # Flow and level are joined by station and date, so both tables are filtered to any station-date changed in either of them (otherwise an unchanged value would be exported as missing)
+    changed_keys = ''
+    if changed_filter != 'true':
+        changed_keys = ' and ("STATION_NUMBER", "{0}") in (select "STATION_NUMBER", "{0}" from {1}.flow where {2} union select "STATION_NUMBER", "{0}" from {1}.level where {2})'.format(
+            datecol,
+            schema,
+            changed_filter
+        )
+
+    # Building queries for flow and level data
+    (flow_query, level_query) = ['select * from {0}.{1} where "{2}" >= \'{3}\' and "{2}" <= \'{4}\'{5}'.format(
+        schema,
+        table,
+        datecol,
+        start_date,
+        end_date,
+        changed_keys
+    ) for table in ['flow', 'level']]
+
+    # Full joining flow and level, with a synthesized boolean pub-status column
+    query = """select
+    coalesce(f."STATION_NUMBER", l."STATION_NUMBER") as "STATION_NUMBER",
+    coalesce(f."{0}", l."{0}") as "{0}",
+    f."Value" as flow,
+    l."Value" as level,
+    coalesce(coalesce(f.pub_status, l.pub_status) = 'Published', false) as pub_status
+from ({1}) as f full outer join ({2}) as l
+on f."STATION_NUMBER" = l."STATION_NUMBER" and f."{0}" = l."{0}"
+""".format(
+        datecol,
+        flow_query,
+        level_query
+    )
+    return 'select "STATION_NUMBER", "{0}", flow, level, case when pub_status then \'True\' else \'False\' end as pub_status from ({1}) as daily'.format(datecol, query)
+
+# Builds the query for Pacfish daily data within a date range, excluding air temperature (which is not a useful parameter). Returns the query and the name of the station column (the first column of the table), as a tuple
+def get_pacfish_daily_query(cursor, start_date, end_date, changed_filter='true'):
+    schema = 'pacfish'
+    table = 'daily'
+    datecol = 'Date'
+
+    # The station column is the first column of the table
+    cursor.execute('select * from {0}.{1} limit 0'.format(schema, table))
+    statcol = cursor.description[0][0]
+
+    # Parameters are stored as separate rows and later reshaped to one row per station and date, so the table is filtered to any station-date with a changed parameter (otherwise unchanged parameters would be exported as missing)
+    changed_keys = ''
+    if changed_filter != 'true':
+        changed_keys = ' and ("{0}", "{1}") in (select "{0}", "{1}" from {2}.{3} where {4})'.format(
+            statcol,
+            datecol,
+            schema,
+            table,
+            changed_filter
+        )
+
+    query = 'select * from {0}.{1} where "{2}" >= \'{3}\' and "{2}" <= \'{4}\' and "Parameter" != \'Air Temperature\'{5}'.format(
+        schema,
+        table,
+        datecol,
+        start_date,
+        end_date,
+        changed_keys
+    )
+    return (query, statcol)
+
+# Formats a Pacfish parameter name as a column name
+def format_param_name(param):
+    return str.lower(param).replace(' ', '_')
+
+# Reshapes Pacfish daily data to one row per station and date, with one column per parameter
+def reshape_pacfish_daily(dat):
+    if dat.shape[0] == 0:
+        return pd.DataFrame(columns=['station_number', 'station_name', 'datetime'])
+    # Apart from the parameter and observation count, the columns are the station number, station name, date and value, in that order
+    (statcol, namecol, dtcol, valcol) = [col for col in dat.columns if col not in ['numObservations', 'Parameter']]
+    # Pivoting all parameters to columns in a single pass
+    daily = dat.groupby([statcol, namecol, dtcol, 'Parameter'], dropna=False)[valcol].first().unstack('Parameter').reset_index()
+    daily.columns = ['station_number', 'station_name', 'datetime'] + [format_param_name(param) for param in daily.columns[3:]]
+    return daily
+
+# Exports the daily data for a schema within a date range to a csv or parquet file, restricted to rows matching a changed-rows condition (see modified_since). Hydat and EC Climate data are streamed straight from the database. Pacfish data must be reshaped before it is written, so it is read either all at once, or in chunks of complete stations on a server-side cursor if a chunk size is given. Returns the number of rows exported
+def export_daily(conn, schema, start_date, end_date, outpath, format='csv', changed_filter='true', chunksize=None):
+    cursor = conn.cursor()
+    if schema == 'pacfish':
+        (query, statcol) = get_pacfish_daily_query(cursor, start_date, end_date, changed_filter)
+        if chunksize is None:
+            # Getting data and reshaping it as a single chunk
+            dailies = [reshape_pacfish_daily(query_to_df(cursor, query))]
+            paramcols = list(dailies[0].columns[3:])
+        else:
+            # Getting the full list of parameters, so that every chunk is written with the same columns
+            cursor.execute('select distinct "Parameter" from ({0}) as dat order by 1'.format(query))
+            paramcols = [format_param_name(row[0]) for row in cursor.fetchall()]
+
+            # Reading data on a server-side cursor, ordered by station so that each chunk holds complete stations, and reshaping each chunk in turn
+            dailies = (
+                reshape_pacfish_daily(chunk).reindex(columns=['station_number', 'station_name', 'datetime'] + paramcols)
+                for chunk in iter_query_chunks(conn, query + ' order by "{0}"'.format(statcol), chunksize, keycol=statcol)
+            )
+        if format == 'parquet':
+            return write_parquet(dailies, outpath, pacfish_arrow_schema(cursor, query, paramcols))
+        return write_csv(dailies, outpath)
+
+    if schema == 'hydat':
+        query = get_hydat_daily_query(start_date, end_date, changed_filter)
+    elif schema == 'ecclimate':
+        query = get_ecclimate_daily_query(start_date, end_date, changed_filter)
+    else:
+        raise ValueError('Unsupported schema: ' + str(schema))
+    if format == 'parquet':
+        return write_parquet(iter_query_chunks(conn, query), outpath, query_arrow_schema(cursor, query))
+    return copy_query_to_csv(cursor, query, outpath)
+
+# Gets the station metadata for a schema
+def get_metadata(cursor, schema):
+    if schema == 'hydat':
+        return get_hydat_metadata(cursor)
+    elif schema == 'ecclimate':
+        return get_ecclimate_metadata(cursor)
+    elif schema == 'pacfish':
+        return get_pacfish_metadata(cursor)
+    raise ValueError('Unsupported schema: ' + str(schema))
+
+# Exports the station metadata for a schema to a csv file
+def export_metadata(conn, schema, fpath):
+    get_metadata(conn.cursor(), schema).to_csv(fpath, index=False)
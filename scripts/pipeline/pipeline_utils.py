@@ -0,0 +1,217 @@
+import os
+import sys
+import asyncio
+import time
+import traceback
+from contextlib import redirect_stdout
+from concurrent.futures import ThreadPoolExecutor
+from depth2water import create_client
+from scripts.gather_new_data.gather_utils import *
+from scripts.gather_new_data.ConnectionPool import ConnectionPool
+from scripts.post_to_d2w.PostD2W import PostD2W
+from scripts.post_to_d2w.ServerMirror import ServerMirror
+from scripts.post_to_d2w.AsyncD2WClient import AsyncD2WClient
+from scripts.post_to_d2w.ThrottledClient import ThrottledClient
+from scripts.post_to_d2w.RunJournal import RunJournal
+from scripts.post_to_d2w.RunMetrics import RunMetrics
+from scripts.post_to_d2w.MeteredClient import MeteredClient
+from scripts.post_to_d2w.post_configs import POST_CONFIGS
+from scripts.post_to_d2w.post_utils import sync_stations, reconcile_stations, reconcile_stations_async, timed_phase
+
+# Names of the supported schemas, in the order they are run by default
+SCHEMAS = ['hydat', 'ecclimate', 'pacfish']
+
+# Gets the daily data for a schema within a date range directly from the database, in the same form as it is written by the gather scripts
+def gather_daily(cursor, schema, start_date, end_date, changed_filter='true'):
+    if schema == 'hydat':
+        return query_to_df(cursor, get_hydat_daily_query(start_date, end_date, changed_filter))
+    elif schema == 'ecclimate':
+        return query_to_df(cursor, get_ecclimate_daily_query(start_date, end_date, changed_filter))
+    elif schema == 'pacfish':
+        (query, statcol) = get_pacfish_daily_query(cursor, start_date, end_date, changed_filter)
+        return reshape_pacfish_daily(query_to_df(cursor, query))
+    raise ValueError('Unsupported schema: ' + str(schema))
+
+# Gathers the station metadata and daily data for a schema within a date range, querying both at once on pooled connections. Returns both as dataframes, in a tuple
+def gather_schema(pool, schema, start_date, end_date, changed_filter='true'):
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        metadata = executor.submit(pool.run, lambda conn: get_metadata(conn.cursor(), schema))
+        daily = executor.submit(pool.run, lambda conn: gather_daily(conn.cursor(), schema, start_date, end_date, changed_filter))
+        return (metadata.result(), daily.result())
+
+# Writes gathered data to the same files the gather scripts export, for when a copy on disk is wanted. The daily data is written as either csv or parquet (with the column types of the posting data)
+def write_gathered_files(fpaths, schema, metadata, daily, format='csv'):
+    metadata.to_csv(fpaths[schema + '-metadata'], index=False)
+    outpath = fpaths['update-data-dir'] + '/' + schema + '-daily.' + format
+    if not os.path.exists(fpaths['update-data-dir']):
+        os.makedirs(fpaths['update-data-dir'])
+    if format == 'parquet':
+        return write_parquet([daily], outpath, dtypes_arrow_schema(POST_CONFIGS[schema]['postd2w']['postdf_dtypes']))
+    else:
+        return write_csv([daily], outpath)
+
+# Initializes the posting class for a schema from gathered dataframes rather than files. If there is no daily data, the posting table is left empty
+def init_postd2w(schema, metadata, daily):
+    return PostD2W(
+        metadata_path=None,
+        postdf_path=None,
+        metadata=metadata,
+        postdf=daily if daily.shape[0] > 0 else None,
+        **POST_CONFIGS[schema]['postd2w']
+    )
+
+# Posts a schema's data to the d2w server: stations are synced first, then the daily data is reconciled against the server data for the date range (see reconcile_stations, which takes any further keyword arguments). If a number of asynchronous requests is given, stations are instead reconciled on an event loop with up to that many requests in flight (see reconcile_stations_async). If a run journal is given, stations it records as complete are skipped. If run metrics are given, the time spent in each phase is recorded in them. Returns the list of per-station reconciliation results
+def post_schema(client, postd2w, start_date, end_date, data_temp_path, mirror_path=None, mirror_max_age=7, async_requests=None, journal=None, metrics=None, **reconcile_args):
+    config = POST_CONFIGS[postd2w.schema]
+
+    # Creating and updating stations
+    with timed_phase(metrics, 'station_sync'):
+        sync_stations(client, config['owner_id'], postd2w.monitoring_type, config['local_stations'](postd2w), config['station_mapping'])
+    print('Station updates complete')
+
+    if postd2w.postdf is None or postd2w.postdf.shape[0] == 0:
+        print('No daily data available in this time range. Skipping data update...')
+        return []
+
+    # Optionally opening the local mirror of server data
+    mirror = ServerMirror(mirror_path, postd2w.monitoring_type, max_age_days=mirror_max_age) if mirror_path is not None else None
+    try:
+        if async_requests is not None:
+            with timed_phase(metrics, 'reconcile'), AsyncD2WClient(client, max_concurrency=async_requests) as aclient:
+                results = asyncio.run(reconcile_stations_async(
+                    aclient=aclient,
+                    postd2w=postd2w,
+                    start_date=start_date,
+                    end_date=end_date,
+                    data_temp_path=data_temp_path,
+                    bulk_fetch=reconcile_args.get('bulk_fetch', False),
+                    owner=config['owner_id'],
+                    mirror=mirror,
+                    journal=journal,
+                    metrics=metrics
+                ))
+        else:
+            with timed_phase(metrics, 'reconcile'):
+                results = reconcile_stations(
+                    client=client,
+                    postd2w=postd2w,
+                    start_date=start_date,
+                    end_date=end_date,
+                    data_temp_path=data_temp_path,
+                    owner=config['owner_id'],
+                    mirror=mirror,
+                    journal=journal,
+                    metrics=metrics,
+                    **reconcile_args
+                )
+    finally:
+        if mirror is not None:
+            mirror.close()
+    print('Time series updates complete')
+    return results
+
+# Runs the gather and post stages for a single schema, in that order, on its own database connections and d2w client, so that schemas can be run independently of one another. If rate control is set, the client is wrapped in a ThrottledClient. If resume is set, the stations completed by an interrupted run with the same date range are skipped (see RunJournal). If a metrics directory is given, a JSON run report and Prometheus textfile are written to it (see RunMetrics), whether or not the run succeeds. Errors are caught and recorded rather than raised, so that a failing schema does not stop the others. Returns a summary of the run as a dictionary
+def run_schema(schema, start_date, end_date, db_creds, client_creds, fpaths, write_files=None, mirror=False, mirror_max_age=7, rate_control=False, resume=False, metrics_dir=None, **reconcile_args):
+    summary = {'schema': schema, 'stage': 'gather', 'rows': 0, 'stations': 0, 'added': 0, 'updated': 0, 'unchanged': 0, 'failed': [], 'gather_seconds': 0.0, 'post_seconds': 0.0, 'error': None}
+    metrics = RunMetrics(schema) if metrics_dir is not None else None
+    try:
+        # Gathering metadata and daily data straight from the database
+        started = time.time()
+        with timed_phase(metrics, 'gather'), ConnectionPool(db_creds, maxconn=2) as pool:
+            (metadata, daily) = gather_schema(pool, schema, start_date, end_date)
+        print('Gathered ' + str(daily.shape[0]) + ' rows of daily data for ' + str(metadata.shape[0]) + ' stations')
+        summary['rows'] = int(daily.shape[0])
+
+        # Optionally keeping a copy of the gathered data on disk
+        if write_files is not None:
+            write_gathered_files(fpaths, schema, metadata, daily, write_files)
+        summary['gather_seconds'] = time.time() - started
+
+        # Posting the gathered data
+        summary['stage'] = 'post'
+        started = time.time()
+        client = create_client(
+            username=client_creds['username'],
+            password=client_creds['password'],
+            client_id=client_creds['client_id'],
+            client_secret=client_creds['client_secret'],
+            host=client_creds['host'],
+            scheme=client_creds['scheme']
+        )
+        if metrics is not None:
+            client = MeteredClient(client, metrics)
+        if rate_control:
+            client = ThrottledClient(client)
+
+        # Path to temporary directory for storing posting files
+        data_temp_path = fpaths['temp-dir'] + '/' + schema
+        if not os.path.exists(data_temp_path):
+            os.makedirs(data_temp_path)
+
+        postd2w = init_postd2w(schema, metadata, daily)
+        with RunJournal(fpaths['temp-dir'] + '/' + schema + '-journal.jsonl', {'schema': schema, 'start_date': start_date, 'end_date': end_date}, resume=resume) as journal:
+            results = post_schema(
+                client=client,
+                postd2w=postd2w,
+                start_date=start_date,
+                end_date=end_date,
+                data_temp_path=data_temp_path,
+                mirror_path=fpaths['temp-dir'] + '/' + schema + '-mirror.sqlite' if mirror else None,
+                mirror_max_age=mirror_max_age,
+                journal=journal,
+                metrics=metrics,
+                **reconcile_args
+            )
+        summary['post_seconds'] = time.time() - started
+        if rate_control:
+            print(client)
+
+        # Totalling the per-station results
+        summary['stations'] = len(results)
+        for key in ['added', 'updated', 'unchanged']:
+            summary[key] = int(sum(result[key] for result in results))
+        summary['failed'] = [result['station'] for result in results if result['error'] is not None]
+        summary['stage'] = 'done'
+    except Exception as e:
+        traceback.print_exc(file=sys.stdout)
+        summary['error'] = repr(e)
+
+    # Writing the run report and Prometheus textfile, including for failed runs
+    if metrics is not None:
+        metrics.add('rows_gathered', summary['rows'])
+        metrics.add('failed', int(summary['error'] is not None))
+        (report_path, prom_path) = metrics.write(metrics_dir)
+        print('Wrote run report to ' + report_path + ' and metrics to ' + prom_path)
+    return summary
+
+# Runs a single schema as in run_schema, with all of its output written to a log file
+def run_schema_logged(log_path, schema, *args, **kwargs):
+    if os.path.dirname(log_path) != '' and not os.path.exists(os.path.dirname(log_path)):
+        os.makedirs(os.path.dirname(log_path))
+    with open(log_path, 'w') as f, redirect_stdout(f):
+        print('===== ' + schema + ' =====')
+        summary = run_schema(schema, *args, **kwargs)
+    summary['log'] = log_path
+    return summary
+
+# Formats a list of schema run summaries as a table for printing
+def format_summaries(summaries):
+    lines = ['{:<10} {:>6} {:>9} {:>9} {:>8} {:>8} {:>10} {:>7} {:>7}  {}'.format('schema', 'status', 'rows', 'stations', 'added', 'updated', 'unchanged', 'gather', 'post', 'failed')]
+    for summary in summaries:
+        status = 'ok' if summary['error'] is None and len(summary['failed']) == 0 else 'FAILED'
+        failed = summary['error'] if summary['error'] is not None else ', '.join(summary['failed'])
+        if summary['error'] is not None:
+            failed = 'error during ' + summary['stage'] + ': ' + failed
+        lines.append('{:<10} {:>6} {:>9} {:>9} {:>8} {:>8} {:>10} {:>6.1f}s {:>6.1f}s  {}'.format(
+            summary['schema'],
+            status,
+            summary['rows'],
+            summary['stations'],
+            summary['added'],
+            summary['updated'],
+            summary['unchanged'],
+            summary['gather_seconds'],
+            summary['post_seconds'],
+            failed
+        ))
+    return '\n'.join(lines)
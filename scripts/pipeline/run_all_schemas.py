@@ -0,0 +1,182 @@
+# Description: Runs the gather and post stages for all schemas concurrently, one process per schema. Within each schema data is always gathered before it is posted, and schemas are otherwise independent (they are posted to different owners), so the total run time is set by the slowest schema rather than the sum of all of them. The output of each schema is written to its own log file, and a summary is printed at the end
+
+# %% ===== Loading libraries =====
+import os
+import sys
+from pathlib import Path
+os.chdir(Path(__file__).parent.parent.parent)
+sys.path.append(os.getcwd())
+import time
+from json import load
+from optparse import OptionParser
+from datetime import datetime, timedelta
+from multiprocessing import get_context
+from concurrent.futures import ProcessPoolExecutor
+from scripts.pipeline.pipeline_utils import *
+
+#%% Initializing option parsing
+parser = OptionParser()
+parser.add_option(
+    "-s", "--startdate",
+    dest="startdate",
+    default=(datetime.today() - timedelta(days=31)).strftime("%Y-%m-%dT00:00:00-00:00"),
+    help="The start date of the date range for which data are being posted. Defaults to 31 days before today")
+parser.add_option(
+    "-e", "--enddate",
+    dest="enddate",
+    default=datetime.today().strftime("%Y-%m-%dT00:00:00-00:00"),
+    help="The end date of the date range for which data are being posted. Defaults to today")
+parser.add_option(
+    "--schemas",
+    dest="schemas",
+    default=','.join(SCHEMAS),
+    help="A comma-separated list of the schemas to run. Defaults to " + ','.join(SCHEMAS))
+parser.add_option(
+    "-p", "--parallel",
+    dest="parallel",
+    type="int",
+    default=None,
+    help="The maximum number of schemas run at once. Defaults to running all schemas at once")
+parser.add_option(
+    "-w", "--workers",
+    dest="workers",
+    type="int",
+    default=1,
+    help="The number of stations to reconcile concurrently against the d2w server, for each schema. Defaults to 1 (sequential)")
+parser.add_option(
+    "--schema-workers",
+    dest="schema_workers",
+    default='',
+    help="Per-schema overrides of the number of workers, as a comma-separated list of schema=workers pairs (e.g hydat=8,pacfish=2)")
+parser.add_option(
+    "-b", "--bulk-fetch",
+    dest="bulk_fetch",
+    action="store_true",
+    default=False,
+    help="Fetch existing server data for all stations in a single windowed query, rather than one query per station")
+parser.add_option(
+    "--batch-size",
+    dest="batch_size",
+    type="int",
+    default=100,
+    help="The number of changed rows queued per batch of update requests. Defaults to 100")
+parser.add_option(
+    "--max-in-flight",
+    dest="max_in_flight",
+    type="int",
+    default=1,
+    help="The maximum number of update requests sent to the d2w server at once, for each schema. Defaults to 1 (sequential)")
+parser.add_option(
+    "-a", "--async-requests",
+    dest="async_requests",
+    type="int",
+    default=None,
+    help="Reconcile stations on an event loop with up to this many requests in flight to the d2w server at once (e.g several hundred), rather than on worker threads. The workers, batch size and max in-flight options are then ignored")
+parser.add_option(
+    "-r", "--rate-control",
+    dest="rate_control",
+    action="store_true",
+    default=False,
+    help="Send all d2w requests through an adaptive rate controller, which adjusts the number of concurrent requests to what the server allows, retries throttled (429/503) and failed (5xx) requests with backoff, and pauses requests if the server keeps failing")
+parser.add_option(
+    "--resume",
+    dest="resume",
+    action="store_true",
+    default=False,
+    help="Resume an interrupted run with the same date range, skipping the stations each schema's journal records as complete")
+parser.add_option(
+    "--metrics-dir",
+    dest="metrics_dir",
+    default=None,
+    help="Record the time spent in each phase, API calls and latencies by endpoint, bytes transferred and row counts for each schema, and write them to this directory as a JSON run report and a Prometheus textfile per schema (e.g the node exporter's textfile directory). By default no metrics are recorded")
+parser.add_option(
+    "-m", "--mirror",
+    dest="mirror",
+    action="store_true",
+    default=False,
+    help="Keep a local mirror of the server data in the temporary directory, and only fetch data that is missing from it or stale")
+parser.add_option(
+    "--mirror-max-age",
+    dest="mirror_max_age",
+    type="int",
+    default=7,
+    help="The number of days after which mirrored server data is considered stale and fetched again. Defaults to 7")
+parser.add_option(
+    "--write-files",
+    dest="write_files",
+    default=None,
+    choices=["csv", "parquet"],
+    help="Also write the gathered metadata and daily data to the files exported by the gather scripts, with the daily data in this format (csv or parquet). By default nothing is written")
+(options, args) = parser.parse_args()
+
+# %% ===== Paths and global variables =====
+
+# Client and database credentials from JSON
+creds = load(open('options/client_credentials.json',))
+db_creds = load(open('options/dbase_credentials.json',))
+
+# Filepaths
+fpaths = load(open('options/filepaths.json', ))
+
+# Directory holding the log file of each schema
+log_dir = fpaths['temp-dir'] + '/logs'
+
+# Schemas to run
+schemas = [schema.strip() for schema in options.schemas.split(',')]
+for schema in schemas:
+    if schema not in SCHEMAS:
+        parser.error('Unsupported schema: ' + schema)
+
+# Number of workers for each schema
+workers = {schema: options.workers for schema in schemas}
+for pair in [pair for pair in options.schema_workers.split(',') if pair.strip() != '']:
+    (schema, nworkers) = pair.split('=')
+    if schema.strip() not in workers:
+        parser.error('Workers given for a schema that is not being run: ' + schema)
+    workers[schema.strip()] = int(nworkers)
+
+#%% Setting update daterange
+start_date = options.startdate
+end_date = options.enddate
+print('Start Date: ' + start_date)
+print('End Date: ' + end_date)
+
+# %% ===== Running all schemas =====
+
+# Each schema runs in its own (forked) process, with its own database connection and d2w client
+started = time.time()
+with ProcessPoolExecutor(max_workers=options.parallel or len(schemas), mp_context=get_context('fork')) as pool:
+    futures = [pool.submit(
+        run_schema_logged,
+        log_dir + '/' + schema + '.log',
+        schema=schema,
+        start_date=start_date,
+        end_date=end_date,
+        db_creds=db_creds,
+        client_creds=creds,
+        fpaths=fpaths,
+        write_files=options.write_files,
+        mirror=options.mirror,
+        mirror_max_age=options.mirror_max_age,
+        workers=workers[schema],
+        bulk_fetch=options.bulk_fetch,
+        update_batch_size=options.batch_size,
+        max_in_flight=options.max_in_flight,
+        async_requests=options.async_requests,
+        rate_control=options.rate_control,
+        resume=options.resume,
+        metrics_dir=options.metrics_dir
+    ) for schema in schemas]
+    for schema in schemas:
+        print('Started ' + schema + ' - logging to ' + log_dir + '/' + schema + '.log')
+    summaries = [future.result() for future in futures]
+
+# %% ===== Summarizing the run =====
+print(format_summaries(summaries))
+print('Completed all schemas in {:.1f}s'.format(time.time() - started))
+
+# Exiting with an error status if any schema or station failed, so that schedulers can flag the run
+if any(summary['error'] is not None or len(summary['failed']) > 0 for summary in summaries):
+    sys.exit(1)
+
+# %%
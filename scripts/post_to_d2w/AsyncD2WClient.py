@@ -0,0 +1,148 @@
+import asyncio
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+
+# Gets the d2w client at the bottom of a stack of wrappers (e.g MeteredClient, ThrottledClient), which each hold the client they wrap as their client attribute
+def innermost_client(client):
+    while 'client' in vars(client):
+        client = vars(client)['client']
+    return client
+
+# Gets a copy of a client (and of each wrapper around it) whose innermost client makes its requests through another session. Copies are made directly from the objects' attributes, as the wrappers pass attribute lookups through to the client they wrap
+def with_session(client, attr, session):
+    clone = object.__new__(type(client))
+    clone.__dict__.update(vars(client))
+    if 'client' in vars(client):
+        clone.client = with_session(vars(client)['client'], attr, session)
+    else:
+        setattr(clone, attr, session)
+    return clone
+
+# Creates a requests session with the same headers, authentication, cookies, hooks and connection settings as another, whose connection pools keep up to pool_size connections per host alive. The retry policy of each of the session's adapters is kept
+def pooled_session(session, pool_size):
+    import requests
+    from requests.adapters import HTTPAdapter
+    pooled = requests.Session()
+    pooled.headers.update(session.headers)
+    pooled.auth = session.auth
+    pooled.cookies.update(session.cookies)
+    pooled.hooks = {event: list(hooks) for event, hooks in session.hooks.items()}
+    pooled.proxies = dict(session.proxies)
+    pooled.verify = session.verify
+    pooled.cert = session.cert
+    for prefix, adapter in session.adapters.items():
+        pooled.mount(prefix, HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=getattr(adapter, 'max_retries', 0)))
+    return pooled
+
+class AsyncD2WClient:
+    def __init__(self, client, max_concurrency=100):
+        # Setting attributes
+        self.client = client
+        self.max_concurrency = max(1, max_concurrency)
+
+        # The d2w client's HTTP session keeps a small pool of connections per host by default, and connections beyond it are closed after each request. If the client exposes its session, requests are made through a copy of the client with its own session, whose pool holds a kept-alive connection for every request in flight. The caller's client and session are left as they are
+        self.session = None
+        inner = innermost_client(client)
+        session = getattr(inner, 'session', getattr(inner, '_session', None))
+        if session is not None and hasattr(session, 'mount'):
+            self.session = pooled_session(session, self.max_concurrency)
+            self.client = with_session(client, 'session' if 'session' in vars(inner) else '_session', self.session)
+
+        # Requests are made by the (blocking) client on a pool of threads, with a semaphore limiting how many are in flight across all callers
+        self.executor = ThreadPoolExecutor(max_workers=self.max_concurrency)
+        self.semaphores = dict()
+
+    def __str__(self):
+        outstr = "Asynchronous d2w client adapter" + '\n' + 'Max concurrent requests: ' + str(self.max_concurrency)
+        return(outstr)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # Gets the semaphore for the running event loop. Semaphores are tied to the loop they are first used in, so one is kept per loop (e.g for successive asyncio.run calls)
+    def semaphore(self):
+        loop = asyncio.get_running_loop()
+        if loop not in self.semaphores:
+            self.semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+        return self.semaphores[loop]
+
+    # Runs a blocking client function without blocking the event loop, waiting for a free slot first
+    async def call(self, fn, *args, **kwargs):
+        async with self.semaphore():
+            return await asyncio.get_running_loop().run_in_executor(self.executor, partial(fn, *args, **kwargs))
+
+    # ===== Stations =====
+    async def get_station_by_station_id(self, *args, **kwargs):
+        return await self.call(self.client.get_station_by_station_id, *args, **kwargs)
+
+    async def get_stations(self, *args, **kwargs):
+        return await self.call(self.client.get_stations, *args, **kwargs)
+
+    async def create_station(self, *args, **kwargs):
+        return await self.call(self.client.create_station, *args, **kwargs)
+
+    async def update_station(self, *args, **kwargs):
+        return await self.call(self.client.update_station, *args, **kwargs)
+
+    # ===== Time series data =====
+    async def get_surface_water_data(self, *args, **kwargs):
+        return await self.call(self.client.get_surface_water_data, *args, **kwargs)
+
+    async def get_climate_data(self, *args, **kwargs):
+        return await self.call(self.client.get_climate_data, *args, **kwargs)
+
+    async def update_surface_water_data(self, *args, **kwargs):
+        return await self.call(self.client.update_surface_water_data, *args, **kwargs)
+
+    async def update_climate_data(self, *args, **kwargs):
+        return await self.call(self.client.update_climate_data, *args, **kwargs)
+
+    async def post_csv_file(self, *args, **kwargs):
+        return await self.call(self.client.post_csv_file, *args, **kwargs)
+
+    # Gets a page of data for a monitoring type, either from a query or from the "next" link of a previous page
+    async def get_data(self, monitoring_type, station_id=None, start_date=None, end_date=None, url=None):
+        if(monitoring_type == 'SURFACE_WATER'):
+            return await self.get_surface_water_data(station_id=station_id, start_date=start_date, end_date=end_date, url=url)
+        elif(monitoring_type == 'CLIMATE'):
+            return await self.get_climate_data(station_id=station_id, start_date=start_date, end_date=end_date, url=url)
+        else:
+            raise ValueError('Unsupported monitoring type: ' + str(monitoring_type))
+
+    # Gets all pages of data for a query, following the "next" links
+    async def get_data_multipage(self, monitoring_type, station_id=None, start_date=None, end_date=None):
+        resp = await self.get_data(monitoring_type, station_id=station_id, start_date=start_date, end_date=end_date)
+        outdata = list(resp['results'])
+        while resp['next'] is not None:
+            resp = await self.get_data(monitoring_type, url=resp['next'])
+            outdata.extend(resp['results'])
+        return outdata
+
+    # Sends a single update payload for a monitoring type
+    async def update_data(self, monitoring_type, updict):
+        if(monitoring_type == 'SURFACE_WATER'):
+            return await self.update_surface_water_data(updict['id'], updict)
+        elif(monitoring_type == 'CLIMATE'):
+            return await self.update_climate_data(updict['id'], updict)
+        else:
+            raise ValueError('Unsupported monitoring type: ' + str(monitoring_type))
+
+    # Sends a list of update payloads concurrently (within the concurrency limit). Failed updates do not stop the rest from being sent - they are returned as a list of (payload, exception) tuples, as in UpdateSubmitter
+    async def update_all(self, monitoring_type, payloads):
+        results = await asyncio.gather(*[self.update_data(monitoring_type, updict) for updict in payloads], return_exceptions=True)
+        return [(updict, result) for updict, result in zip(payloads, results) if isinstance(result, Exception)]
+
+    # Waits for any running requests, shuts down the thread pool and closes the adapter's own session
+    def close(self):
+        self.executor.shutdown(wait=True)
+        if self.session is not None:
+            self.session.close()
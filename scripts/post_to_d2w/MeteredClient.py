@@ -0,0 +1,61 @@
+import os
+import json
+import time
+
+class MeteredClient:
+    def __init__(self, client, metrics):
+        # Setting attributes
+        self.client = client
+        self.metrics = metrics
+
+        # If the client exposes its HTTP session, the bytes of every request and response are counted from a session hook. Otherwise they are estimated from the size of the data passed to and returned by each call
+        self.session = getattr(client, 'session', getattr(client, '_session', None))
+        self.hooked = self.session is not None and hasattr(self.session, 'hooks')
+        if self.hooked:
+            self.session.hooks.setdefault('response', []).append(self.count_response_bytes)
+
+    def __str__(self):
+        outstr = "Metered d2w client" + '\n' + 'Bytes counted from: ' + ('session' if self.hooked else 'estimates')
+        return(outstr)
+
+    # Any client function is timed and counted under its name. Other attributes are passed through
+    def __getattr__(self, name):
+        attr = getattr(self.client, name)
+        if not callable(attr):
+            return attr
+        def metered(*args, **kwargs):
+            return self.call(name, attr, *args, **kwargs)
+        return metered
+
+    # Calls a client function, recording its latency and whether it failed
+    def call(self, endpoint, fn, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception:
+            self.metrics.record_call(endpoint, time.perf_counter() - started, error=True)
+            raise
+        self.metrics.record_call(endpoint, time.perf_counter() - started)
+        if not self.hooked:
+            self.metrics.add_bytes(sent=self.estimate_sent_bytes(endpoint, args, kwargs), received=self.estimate_size(result))
+        return result
+
+    # Session hook counting the bytes of a request and its response
+    def count_response_bytes(self, response, *args, **kwargs):
+        body = getattr(response.request, 'body', None)
+        sent = len(body) if isinstance(body, (bytes, str)) else 0
+        self.metrics.add_bytes(sent=sent, received=len(response.content or b''))
+
+    # Estimates the bytes sent by a call: the size of an uploaded file, or of the JSON arguments
+    def estimate_sent_bytes(self, endpoint, args, kwargs):
+        if endpoint == 'post_csv_file' and len(args) > 0 and isinstance(args[0], str) and os.path.exists(args[0]):
+            return os.path.getsize(args[0])
+        return self.estimate_size([args, kwargs])
+
+    def estimate_size(self, data):
+        if data is None:
+            return 0
+        try:
+            return len(json.dumps(data, default=str))
+        except (TypeError, ValueError):
+            return 0
@@ -1,52 +1,86 @@
 import pandas as pd
+from numpy import nan
 
 class PostD2W:
-    def __init__(self, schema, monitoring_type, metadata_path, metadata_dtypes, postdf_path, postdf_dtypes, metadata_statcol, postdf_statcol, postdf_datecol, ps_col_mappings):        
+    def __init__(self, schema, monitoring_type, metadata_path, metadata_dtypes, postdf_path, postdf_dtypes, metadata_statcol, postdf_statcol, postdf_datecol, ps_col_mappings, metadata=None, postdf=None):        
         # Setting attributes 
         self.schema = schema
         self.monitoring_type = monitoring_type
         self.metadata_statcol = metadata_statcol
         self.postdf_statcol = postdf_statcol
         self.postdf_datecol = postdf_datecol
+        # Copying the posting data types, as the date column type is changed below
+        postdf_dtypes = dict(postdf_dtypes)
         self.postdf_dtypes = postdf_dtypes
 
         # Setting the base column mappings attribute
         self.ps_col_mappings = ps_col_mappings
 
-        # Reading metadata
-        self.metadata = pd.read_csv(
-            metadata_path, 
-            # Splitting out non-date columns
-            dtype={key:value for key, value in metadata_dtypes.items() if value != 'datetime64'}, 
-            # Passing datetime columns to parse dates
-            parse_dates=[key for key, value in metadata_dtypes.items() if value == 'datetime64']
-        )
+        # Reading metadata, unless it has been passed in directly as a dataframe (e.g straight from the database)
+        if metadata is not None:
+            # Treating missing values and dates as they would be when read from file
+            self.metadata = metadata.where(metadata.notna(), nan)
+            for key in [key for key, value in metadata_dtypes.items() if value == 'datetime64']:
+                self.metadata[key] = pd.to_datetime(self.metadata[key])
+        else:
+            self.metadata = pd.read_csv(
+                metadata_path, 
+                # Splitting out non-date columns
+                dtype={key:value for key, value in metadata_dtypes.items() if value != 'datetime64'}, 
+                # Passing datetime columns to parse dates
+                parse_dates=[key for key, value in metadata_dtypes.items() if value == 'datetime64']
+            )
         self.metadata = self.metadata.astype(metadata_dtypes)
+        # Indexing metadata by station ID for constant-time lookups (keeping the first row where a station is duplicated)
+        self.metadata_index = self.metadata.drop_duplicates(subset=metadata_statcol, keep='first').set_index(metadata_statcol, drop=False)
 
-        # Reading table of data to post/update
-        try:
-            self.postdf = pd.read_csv(postdf_path)
-            # Setting types - ensuring the date column is initially a string
-            postdf_dtypes[postdf_datecol] = 'str'
-            self.postdf = self.postdf.astype(postdf_dtypes)
-            # Converting the date column tx`o acorrectly formatted YMD date
-            self.postdf.loc[:, postdf_datecol] = pd.to_datetime(pd.to_datetime(self.postdf[postdf_datecol], utc=False).dt.date)
-            # Filtering daily dataset to only include stations reference in the metadata file (this ensures that data with no stations are excluded)
-            self.postdf = self.postdf[self.postdf[self.postdf_statcol].isin(self.metadata[self.metadata_statcol])]
-            # Removing 'nan' string values that are populated
-            self.postdf = self.postdf.applymap(lambda x: '' if (type(x) == str) & (x == 'nan') else x)
-        except:
-            # If the daily data read fails, printing a status message and saving this as None.
-            print('No daily dataset found')
-            self.postdf = None
+        # Setting types at read time - ensuring the date column is initially a string
+        postdf_dtypes[postdf_datecol] = 'str'
+        strcols = [key for key, value in postdf_dtypes.items() if value == 'str' and key != postdf_datecol]
+
+        # Reading table of data to post/update. Without a table passed in or a file to read it from, the posting table is empty (with the posting columns and types)
+        if postdf is None and postdf_path is None:
+            self.postdf = pd.DataFrame({key: pd.Series(dtype='datetime64[ns]' if key == postdf_datecol else value) for key, value in postdf_dtypes.items()})
+        else:
+            try:
+                if postdf is not None or str(postdf_path).endswith('.parquet'):
+                    # Dataframes passed in directly and parquet files already hold typed data, so types are only converted where they differ. Missing values in string columns are replaced with empty strings first
+                    self.postdf = postdf.copy() if postdf is not None else pd.read_parquet(postdf_path)
+                    self.postdf[strcols] = self.postdf[strcols].fillna('')
+                    self.postdf = self.postdf.astype({key: value for key, value in postdf_dtypes.items() if key != postdf_datecol}, copy=False)
+                else:
+                    self.postdf = pd.read_csv(postdf_path, dtype=postdf_dtypes)
+                    # Replacing missing values with empty strings, only in string columns
+                    self.postdf[strcols] = self.postdf[strcols].fillna('')
+                # Converting the date column to a correctly formatted YMD date. Dates that are already stored as (timezone-naive) datetimes only need their times dropped
+                if pd.api.types.is_datetime64_dtype(self.postdf[postdf_datecol]):
+                    self.postdf[postdf_datecol] = self.postdf[postdf_datecol].dt.normalize()
+                else:
+                    self.postdf.loc[:, postdf_datecol] = pd.to_datetime(pd.to_datetime(self.postdf[postdf_datecol], utc=False).dt.date)
+                # Filtering daily dataset to only include stations reference in the metadata file (this ensures that data with no stations are excluded)
+                self.postdf = self.postdf[self.postdf[self.postdf_statcol].isin(self.metadata[self.metadata_statcol])]
+            except:
+                # If the daily data read fails, printing a status message and saving this as None.
+                print('No daily dataset found')
+                self.postdf = None
     
     def __str__(self):
         outstr = "Posting D2W object for database: " + self.schema + '\n' + 'Metadata station ID: ' + self.metadata_statcol + '\n' + 'Posting table station ID: ' + self.postdf_statcol
         return(outstr)
 
-    # Helper function to quickly access values from the downloaded metadata file for a station
+    # Helper function to quickly access values from the downloaded metadata file for a station. Accepts either a single column name or a list of column names
     def pull_from_metadata(self, statid, varname, roundfigs=5):
-        value = self.metadata.loc[self.metadata[self.metadata_statcol] == statid].iloc[0][varname]
+        if isinstance(varname, list):
+            value = self.metadata_index.loc[statid, varname]
+        else:
+            value = self.metadata_index.at[statid, varname]
         if isinstance(value, (int, float)):
             value = round(value, roundfigs)
-        return(value)
\ No newline at end of file
+        return(value)
+
+    # Helper function to access a set of metadata columns for all stations at once, as a single frame indexed by station ID. Numeric columns are rounded in the same way as in pull_from_metadata
+    def pull_all_from_metadata(self, varnames, roundfigs=5):
+        values = self.metadata_index[varnames].copy()
+        floatcols = values.select_dtypes('float').columns
+        values[floatcols] = values[floatcols].round(roundfigs)
+        return(values)
\ No newline at end of file
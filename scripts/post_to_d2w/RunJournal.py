@@ -0,0 +1,121 @@
+import os
+import json
+import hashlib
+from threading import Lock
+from datetime import datetime
+
+class RunJournal:
+    def __init__(self, path, run_key, resume=False):
+        # Setting attributes
+        self.path = path
+        self.run_key = run_key
+
+        # Work recorded as complete: station results by station ID, the keys of sent update payloads, and uploaded file names
+        self.stations = dict()
+        self.updates = set()
+        self.uploads = set()
+
+        # Ensuring the directory holding the journal exists
+        if os.path.dirname(path) != '' and not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+
+        # When resuming, loading the work recorded by the previous run. A journal left by a run with different settings (e.g another date range) can't be resumed from, so a new one is started
+        self.resumed = False
+        if resume and os.path.exists(path):
+            self.resumed = self.load()
+            if not self.resumed:
+                print('Journal at ' + path + ' is from a different run. Starting from the first station...')
+
+        # The journal is only ever appended to, one JSON entry per line, so that everything recorded before a crash survives it
+        self.lock = Lock()
+        if self.resumed:
+            self.file = open(path, 'a')
+        else:
+            self.file = open(path, 'w')
+            self.record('run', **run_key)
+
+    def __str__(self):
+        outstr = "Run journal at: " + self.path + '\n' + 'Resumed: ' + str(self.resumed) + '\n' + 'Completed stations: ' + str(len(self.stations)) + '\n' + 'Sent updates: ' + str(len(self.updates)) + '\n' + 'Uploaded files: ' + str(len(self.uploads))
+        return(outstr)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # Reads the entries of an existing journal, returning whether it was written by a run with the same settings. A partly written last line (from a run killed mid-write) is ignored
+    def load(self):
+        with open(self.path) as f:
+            entries = []
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    continue
+        if len(entries) == 0 or entries[0].get('event') != 'run' or any(entries[0].get(key) != value for key, value in self.run_key.items()):
+            return False
+        for entry in entries[1:]:
+            if entry['event'] == 'station':
+                self.stations[entry['station']] = entry
+            elif entry['event'] == 'update':
+                self.updates.add(entry['key'])
+            elif entry['event'] == 'upload':
+                self.uploads.add(entry['file'])
+        return True
+
+    # Appends entries to the journal in a single write, making sure they are on disk before returning
+    def record_many(self, event, entries):
+        now = datetime.now().isoformat()
+        lines = ''.join(json.dumps(dict(event=event, time=now, **fields), default=str) + '\n' for fields in entries)
+        with self.lock:
+            self.file.write(lines)
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    # Appends a single entry to the journal
+    def record(self, event, **fields):
+        self.record_many(event, [fields])
+
+    # Gets a key identifying an update payload: the server record ID and the values sent, so that a later change to the same record is not mistaken for one already sent
+    def update_key(self, updict):
+        return str(updict['id']) + ':' + hashlib.sha1(json.dumps(updict, sort_keys=True, default=str).encode()).hexdigest()
+
+    # ===== Stations =====
+    def is_station_complete(self, station_id):
+        return str(station_id) in self.stations
+
+    # Records a station as complete, from its reconciliation result
+    def record_station(self, result):
+        entry = {'station': str(result['station']), 'added': int(result['added']), 'updated': int(result['updated']), 'unchanged': int(result['unchanged'])}
+        self.record('station', **entry)
+        with self.lock:
+            self.stations[entry['station']] = entry
+
+    # ===== Updates =====
+    # Returns the update payloads from a list that have not already been sent
+    def unsent_updates(self, payloads):
+        with self.lock:
+            return [updict for updict in payloads if self.update_key(updict) not in self.updates]
+
+    # Records a list of update payloads as sent
+    def record_updates(self, station_id, payloads):
+        keys = [self.update_key(updict) for updict in payloads]
+        if len(keys) == 0:
+            return
+        self.record_many('update', [{'station': station_id, 'key': key} for key in keys])
+        with self.lock:
+            self.updates.update(keys)
+
+    # ===== Uploads =====
+    def is_uploaded(self, fname):
+        return fname in self.uploads
+
+    def record_upload(self, fname):
+        self.record('upload', file=fname)
+        with self.lock:
+            self.uploads.add(fname)
+
+    def close(self):
+        with self.lock:
+            self.file.close()
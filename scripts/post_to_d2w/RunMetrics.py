@@ -0,0 +1,142 @@
+import os
+import json
+import time
+from threading import Lock
+from contextlib import contextmanager
+from datetime import datetime
+
+class RunMetrics:
+    # Upper bounds (in seconds) of the API latency histogram buckets
+    LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+
+    def __init__(self, schema):
+        # Setting attributes
+        self.schema = schema
+        self.started = datetime.now()
+        self.start_time = time.time()
+
+        # Time spent in each phase: total seconds and number of times it was entered. Phases timed within each station (e.g fetch, compare) are summed over all stations, so with concurrent workers they can add up to more than the wall time of the run
+        self.phases = dict()
+        # Per-endpoint API calls: number of calls and errors, total latency, and a histogram of latencies
+        self.api = dict()
+        # Bytes sent to and received from the d2w server
+        self.bytes = {'sent': 0, 'received': 0}
+        # Other counts, e.g rows added, updated and unchanged
+        self.counters = dict()
+        self.lock = Lock()
+
+    def __str__(self):
+        outstr = "Run metrics for schema: " + self.schema + '\n' + 'Phases: ' + ', '.join('{} {:.1f}s'.format(name, phase['seconds']) for name, phase in self.phases.items()) + '\n' + 'API calls: ' + str(sum(endpoint['calls'] for endpoint in self.api.values())) + '\n' + 'Bytes sent/received: ' + str(self.bytes['sent']) + '/' + str(self.bytes['received']) + '\n' + 'Counters: ' + str(self.counters)
+        return(outstr)
+
+    # Times a block of work as part of a phase
+    @contextmanager
+    def timed(self, phase):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_phase_time(phase, time.perf_counter() - started)
+
+    def add_phase_time(self, phase, seconds):
+        with self.lock:
+            if phase not in self.phases:
+                self.phases[phase] = {'seconds': 0.0, 'count': 0}
+            self.phases[phase]['seconds'] += seconds
+            self.phases[phase]['count'] += 1
+
+    # Records a single API call to an endpoint, its latency, and whether it failed
+    def record_call(self, endpoint, seconds, error=False):
+        with self.lock:
+            if endpoint not in self.api:
+                self.api[endpoint] = {'calls': 0, 'errors': 0, 'seconds': 0.0, 'buckets': [0] * (len(self.LATENCY_BUCKETS) + 1)}
+            stats = self.api[endpoint]
+            stats['calls'] += 1
+            stats['errors'] += int(error)
+            stats['seconds'] += seconds
+            # The last bucket holds calls slower than every bound
+            bucket = next((i for i, bound in enumerate(self.LATENCY_BUCKETS) if seconds <= bound), len(self.LATENCY_BUCKETS))
+            stats['buckets'][bucket] += 1
+
+    def add_bytes(self, sent=0, received=0):
+        with self.lock:
+            self.bytes['sent'] += sent
+            self.bytes['received'] += received
+
+    def add(self, counter, value=1):
+        with self.lock:
+            self.counters[counter] = self.counters.get(counter, 0) + value
+
+    # Counts the rows added, updated and unchanged, and the failed stations, from a list of per-station reconciliation results
+    def add_results(self, results):
+        for key in ['added', 'updated', 'unchanged']:
+            self.add('rows_' + key, int(sum(result[key] for result in results)))
+        self.add('stations', len(results))
+        self.add('stations_failed', len([result for result in results if result['error'] is not None]))
+
+    # Gets the run's metrics as a dictionary. Histogram buckets are cumulative, as in Prometheus
+    def report(self):
+        with self.lock:
+            api = dict()
+            for endpoint, stats in self.api.items():
+                cumulative = [sum(stats['buckets'][:i + 1]) for i in range(len(stats['buckets']))]
+                api[endpoint] = {
+                    'calls': stats['calls'],
+                    'errors': stats['errors'],
+                    'seconds': stats['seconds'],
+                    'latency_buckets': dict(zip([str(bound) for bound in self.LATENCY_BUCKETS] + ['+Inf'], cumulative))
+                }
+            return {
+                'schema': self.schema,
+                'started': self.started.isoformat(),
+                'finished': datetime.now().isoformat(),
+                'wall_seconds': time.time() - self.start_time,
+                'phases': {name: dict(phase) for name, phase in self.phases.items()},
+                'api': api,
+                'bytes': dict(self.bytes),
+                'counters': dict(self.counters)
+            }
+
+    # Formats the run's metrics in the Prometheus text exposition format. Each file describes only the last run, so values are gauges rather than counters
+    def prometheus(self):
+        report = self.report()
+        label = 'schema="' + self.schema + '"'
+        lines = []
+        def metric(name, kind, help, samples):
+            lines.append('# HELP ' + name + ' ' + help)
+            lines.append('# TYPE ' + name + ' ' + kind)
+            for (suffix, labels, value) in samples:
+                lines.append(name + suffix + '{' + ','.join([label] + labels) + '} ' + repr(float(value)))
+
+        metric('d2w_post_last_run_timestamp_seconds', 'gauge', 'Time the last posting run finished.', [('', [], time.time())])
+        metric('d2w_post_run_seconds', 'gauge', 'Wall time of the last posting run.', [('', [], report['wall_seconds'])])
+        metric('d2w_post_phase_seconds', 'gauge', 'Time spent in each phase of the last posting run.', [('', ['phase="' + name + '"'], phase['seconds']) for name, phase in report['phases'].items()])
+        metric('d2w_post_api_calls', 'gauge', 'API calls made to the d2w server in the last posting run.', [('', ['endpoint="' + endpoint + '"'], stats['calls']) for endpoint, stats in report['api'].items()])
+        metric('d2w_post_api_errors', 'gauge', 'API calls to the d2w server that failed in the last posting run.', [('', ['endpoint="' + endpoint + '"'], stats['errors']) for endpoint, stats in report['api'].items()])
+        samples = []
+        for endpoint, stats in report['api'].items():
+            samples.extend([('_bucket', ['endpoint="' + endpoint + '"', 'le="' + bound + '"'], count) for bound, count in stats['latency_buckets'].items()])
+            samples.append(('_sum', ['endpoint="' + endpoint + '"'], stats['seconds']))
+            samples.append(('_count', ['endpoint="' + endpoint + '"'], stats['calls']))
+        metric('d2w_post_api_request_duration_seconds', 'histogram', 'Latency of API calls to the d2w server in the last posting run.', samples)
+        metric('d2w_post_bytes', 'gauge', 'Bytes transferred to and from the d2w server in the last posting run.', [('', ['direction="' + direction + '"'], value) for direction, value in report['bytes'].items()])
+        metric('d2w_post_rows', 'gauge', 'Rows of daily data by outcome in the last posting run.', [('', ['outcome="' + counter[len('rows_'):] + '"'], value) for counter, value in report['counters'].items() if counter.startswith('rows_')])
+        metric('d2w_post_stations', 'gauge', 'Stations reconciled in the last posting run.', [('', [], report['counters'].get('stations', 0))])
+        metric('d2w_post_stations_failed', 'gauge', 'Stations that failed to reconcile in the last posting run.', [('', [], report['counters'].get('stations_failed', 0))])
+        return '\n'.join(lines) + '\n'
+
+    # Writes a file by renaming a temporary copy into place, so that readers (e.g the node exporter) never see a partly written file
+    def write_atomic(self, fpath, text):
+        if os.path.dirname(fpath) != '' and not os.path.exists(os.path.dirname(fpath)):
+            os.makedirs(os.path.dirname(fpath))
+        with open(fpath + '.tmp', 'w') as f:
+            f.write(text)
+        os.replace(fpath + '.tmp', fpath)
+
+    # Writes the JSON run report and the Prometheus textfile for the run to a directory, returning their paths
+    def write(self, out_dir):
+        json_path = out_dir + '/' + self.schema + '-run-report.json'
+        prom_path = out_dir + '/d2w_post_' + self.schema + '.prom'
+        self.write_atomic(json_path, json.dumps(self.report(), indent=2))
+        self.write_atomic(prom_path, self.prometheus())
+        return (json_path, prom_path)
@@ -0,0 +1,90 @@
+import os
+import json
+import sqlite3
+from threading import Lock
+from datetime import datetime, timedelta
+import pandas as pd
+
+class ServerMirror:
+    def __init__(self, db_path, monitoring_type, max_age_days=7):
+        # Setting attributes
+        self.db_path = db_path
+        self.monitoring_type = monitoring_type
+        self.max_age = timedelta(days=max_age_days)
+
+        # Ensuring the directory holding the mirror exists
+        if os.path.dirname(db_path) != '' and not os.path.exists(os.path.dirname(db_path)):
+            os.makedirs(os.path.dirname(db_path))
+
+        # Opening the mirror database - a single connection is shared between threads, guarded by a lock
+        self.lock = Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self.lock, self.conn:
+            # Last-known server records, stored as raw JSON, one per station and date
+            self.conn.execute('create table if not exists records (monitoring_type text, station_id text, date text, record text, primary key (monitoring_type, station_id, date))')
+            # The dates for which the server state of each station is known (whether or not a record exists), and when they were fetched
+            self.conn.execute('create table if not exists coverage (monitoring_type text, station_id text, date text, fetched_at text, primary key (monitoring_type, station_id, date))')
+
+    def __str__(self):
+        outstr = "D2W server mirror at: " + self.db_path + '\n' + 'Monitoring type: ' + self.monitoring_type + '\n' + 'Maximum age: ' + str(self.max_age)
+        return(outstr)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # Returns the dates within a date range (as YMD strings) for which the mirror has no fresh copy of a station's server data
+    def missing_dates(self, station_id, start_date, end_date):
+        dates = pd.date_range(pd.to_datetime(start_date).date(), pd.to_datetime(end_date).date()).strftime('%Y-%m-%d')
+        cutoff = (datetime.now() - self.max_age).isoformat()
+        with self.lock:
+            rows = self.conn.execute(
+                'select date from coverage where monitoring_type = ? and station_id = ? and date >= ? and date <= ? and fetched_at >= ?',
+                (self.monitoring_type, station_id, dates[0], dates[-1], cutoff)
+            ).fetchall()
+        covered = set(row[0] for row in rows)
+        return [date for date in dates if date not in covered]
+
+    # Returns the raw server records stored for a station within a date range
+    def load(self, station_id, start_date, end_date):
+        with self.lock:
+            rows = self.conn.execute(
+                'select record from records where monitoring_type = ? and station_id = ? and date >= ? and date <= ? order by date',
+                (self.monitoring_type, station_id, pd.to_datetime(start_date).strftime('%Y-%m-%d'), pd.to_datetime(end_date).strftime('%Y-%m-%d'))
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    # Stores freshly fetched server records for a station, replacing anything previously stored for the listed dates, and marks those dates as covered
+    def store(self, station_id, records, dates):
+        fetched_at = datetime.now().isoformat()
+        dates = set(dates)
+        # Keeping only records that fall on the listed dates
+        bydate = {pd.to_datetime(record['datetime']).strftime('%Y-%m-%d'): record for record in records}
+        bydate = {date: record for date, record in bydate.items() if date in dates}
+        with self.lock, self.conn:
+            self.conn.executemany(
+                'delete from records where monitoring_type = ? and station_id = ? and date = ?',
+                [(self.monitoring_type, station_id, date) for date in dates]
+            )
+            self.conn.executemany(
+                'insert into records values (?, ?, ?, ?)',
+                [(self.monitoring_type, station_id, date, json.dumps(record)) for date, record in bydate.items()]
+            )
+            self.conn.executemany(
+                'insert or replace into coverage values (?, ?, ?, ?)',
+                [(self.monitoring_type, station_id, date, fetched_at) for date in dates]
+            )
+
+    # Forgets the server state of a station for a set of dates, e.g after data for those dates has been written to the server, so that they are fetched again on the next run
+    def invalidate(self, station_id, dates):
+        with self.lock, self.conn:
+            self.conn.executemany(
+                'delete from coverage where monitoring_type = ? and station_id = ? and date = ?',
+                [(self.monitoring_type, station_id, date) for date in dates]
+            )
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
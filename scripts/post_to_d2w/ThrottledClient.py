@@ -0,0 +1,161 @@
+import time
+import random
+from threading import Condition
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+
+# Raised instead of making a request while the circuit breaker is open
+class CircuitOpenError(Exception):
+    pass
+
+# Gets the HTTP status code from an error raised by the client, if there is one
+def error_status(e):
+    response = getattr(e, 'response', None)
+    status = getattr(response, 'status_code', getattr(e, 'status_code', getattr(e, 'status', None)))
+    return status if isinstance(status, int) else None
+
+# Gets the number of seconds to wait from the Retry-After header of an error's response (given either as seconds or as a date), if there is one
+def error_retry_after(e):
+    headers = getattr(getattr(e, 'response', None), 'headers', None) or {}
+    value = headers.get('Retry-After')
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        try:
+            return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+        except (TypeError, ValueError):
+            return None
+
+# Whether an error is a connection failure or timeout, rather than a response from the server
+def is_connection_error(e):
+    return isinstance(e, (ConnectionError, TimeoutError)) or type(e).__name__ in ['ConnectionError', 'Timeout', 'ConnectTimeout', 'ReadTimeout']
+
+class ThrottledClient:
+    # Statuses where the server asks for fewer requests - these were not processed, so any request can be retried
+    THROTTLE_STATUSES = [429, 503]
+    # Statuses where the server failed - only requests that are safe to repeat are retried
+    ERROR_STATUSES = [500, 502, 504]
+    # Client functions that create something, and so are not safe to repeat if the server may have processed them
+    UNSAFE_FUNCTIONS = ['create_station', 'post_csv_file']
+
+    def __init__(self, client, initial_limit=8, min_limit=1, max_limit=256, max_retries=5, base_delay=0.5, max_delay=60, failure_threshold=10, cooldown=30):
+        # Setting attributes
+        self.client = client
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+
+        # Adaptive concurrency state: the limit grows by about one request for each limit's worth of successes, and halves when the server pushes back. Only requests sent after the last decrease can cause another, so that a burst of rejections for requests sent under the old limit only counts once
+        self.limit = float(min(max(initial_limit, self.min_limit), self.max_limit))
+        self.in_flight = 0
+        self.last_decrease = 0.0
+
+        # Circuit breaker state: after failure_threshold consecutive failures the circuit opens, and requests fail immediately until the cooldown has passed. A single trial request is then let through, which closes the circuit again if it succeeds
+        self.failures = 0
+        self.open_until = None
+        self.trial_in_flight = False
+
+        # Counts of what happened to requests
+        self.stats = {'calls': 0, 'retries': 0, 'throttled': 0, 'errors': 0, 'rejected': 0}
+        self.condition = Condition()
+
+    def __str__(self):
+        outstr = "Throttled d2w client" + '\n' + 'Concurrency limit: ' + str(int(self.limit)) + '\n' + 'Circuit: ' + ('open' if self.open_until is not None else 'closed') + '\n' + 'Stats: ' + str(self.stats)
+        return(outstr)
+
+    # Any client function is wrapped with rate control. Other attributes are passed through
+    def __getattr__(self, name):
+        attr = getattr(self.client, name)
+        if not callable(attr):
+            return attr
+        def throttled(*args, **kwargs):
+            return self.call(attr, name in self.UNSAFE_FUNCTIONS, *args, **kwargs)
+        return throttled
+
+    # Waits for a free request slot under the current limit, returning whether the request is a circuit breaker trial and when it was sent. Raises a CircuitOpenError if the circuit is open
+    def acquire(self):
+        with self.condition:
+            while True:
+                if self.open_until is not None:
+                    if time.monotonic() < self.open_until or self.trial_in_flight:
+                        self.stats['rejected'] += 1
+                        raise CircuitOpenError('Too many consecutive failures from the d2w server - requests are paused until the circuit breaker resets')
+                    # Letting a single trial request through
+                    self.trial_in_flight = True
+                    self.in_flight += 1
+                    self.stats['calls'] += 1
+                    return (True, time.monotonic())
+                if self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    self.stats['calls'] += 1
+                    return (False, time.monotonic())
+                self.condition.wait()
+
+    # Frees a request slot, adjusting the limit and circuit breaker according to the outcome: 'ok', 'throttled', 'error' (the server failed), or 'other' (the request failed for reasons unrelated to load, e.g a bad request)
+    def release(self, outcome, trial=False, sent=None):
+        with self.condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if outcome in ['ok', 'other']:
+                if outcome == 'ok':
+                    self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+                self.failures = 0
+                if trial:
+                    self.open_until = None
+            else:
+                if sent is None or sent >= self.last_decrease:
+                    self.limit = max(self.min_limit, self.limit / 2)
+                    self.last_decrease = now
+                if outcome == 'throttled':
+                    self.stats['throttled'] += 1
+                else:
+                    self.stats['errors'] += 1
+                    self.failures += 1
+                    if trial or self.failures >= self.failure_threshold:
+                        self.open_until = now + self.cooldown
+            if trial:
+                self.trial_in_flight = False
+            self.condition.notify_all()
+
+    # Gets the time to wait before a retry: the server's Retry-After time if it gave one, otherwise an exponential backoff with full jitter
+    def backoff(self, attempt, e):
+        retry_after = error_retry_after(e)
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    # Calls a client function under rate control, retrying throttled and failed requests. Requests that create something are only retried if the server rejected them outright (throttling), so that a retry never duplicates a write
+    def call(self, fn, unsafe, *args, **kwargs):
+        attempt = 0
+        while True:
+            (trial, sent) = self.acquire()
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                status = error_status(e)
+                if status in self.THROTTLE_STATUSES:
+                    self.release('throttled', trial, sent)
+                    retryable = True
+                elif status in self.ERROR_STATUSES or (status is None and is_connection_error(e)):
+                    self.release('error', trial, sent)
+                    retryable = not unsafe
+                else:
+                    # Other errors (e.g a bad request) are not a sign of an overloaded server, and are not retried
+                    self.release('other', trial, sent)
+                    raise
+                if not retryable or attempt >= self.max_retries:
+                    raise
+                # Waiting outside of the request slot, so that other requests can use it
+                time.sleep(self.backoff(attempt, e))
+                attempt += 1
+                with self.condition:
+                    self.stats['retries'] += 1
+                continue
+            self.release('ok', trial, sent)
+            return result
@@ -0,0 +1,50 @@
+from concurrent.futures import ThreadPoolExecutor, wait
+
+class UpdateSubmitter:
+    def __init__(self, client, monitoring_type, batch_size=100, max_in_flight=1):
+        # Setting attributes
+        self.client = client
+        self.monitoring_type = monitoring_type
+        self.batch_size = max(1, batch_size)
+        self.max_in_flight = max(1, max_in_flight)
+
+        # Different update function for different data types
+        if(monitoring_type == 'SURFACE_WATER'):
+            self.update_fn = client.update_surface_water_data
+        elif(monitoring_type == 'CLIMATE'):
+            self.update_fn = client.update_climate_data
+        else:
+            raise ValueError('Unsupported monitoring type: ' + str(monitoring_type))
+
+        # A single pool shared by every caller, so the in-flight limit applies to the whole run rather than to each station. The client (and its session) is reused by every request
+        self.pool = ThreadPoolExecutor(max_workers=self.max_in_flight)
+
+    def __str__(self):
+        outstr = "Update submitter for monitoring type: " + self.monitoring_type + '\n' + 'Batch size: ' + str(self.batch_size) + '\n' + 'Max in-flight requests: ' + str(self.max_in_flight)
+        return(outstr)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # Sends a single update payload to the server
+    def send(self, updict):
+        return self.update_fn(updict['id'], updict)
+
+    # Queues a list of update payloads and sends them in batches. Requests within a batch are pipelined over the pool, and each batch completes before the next one is queued. Failed updates do not stop the rest from being sent - they are returned as a list of (payload, exception) tuples. If on_sent is given, it is called with the payloads of each batch that were sent successfully
+    def submit(self, payloads, on_sent=None):
+        failures = []
+        for start in range(0, len(payloads), self.batch_size):
+            batch = payloads[start:start + self.batch_size]
+            futures = [self.pool.submit(self.send, updict) for updict in batch]
+            wait(futures)
+            failures.extend([(updict, future.exception()) for updict, future in zip(batch, futures) if future.exception() is not None])
+            if on_sent is not None:
+                on_sent([updict for updict, future in zip(batch, futures) if future.exception() is None])
+        return failures
+
+    # Waits for any queued updates and shuts down the pool
+    def close(self):
+        self.pool.shutdown(wait=True)
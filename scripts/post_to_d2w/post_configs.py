@@ -0,0 +1,229 @@
+from datetime import datetime
+from depth2water import get_surface_water_station_mapping, get_climate_station_mapping
+
+# Per-schema settings shared by the posting scripts and the single-process pipeline. For each schema this holds the D2W owner ID, the function mapping station parameters to a D2W station, a function building the table of local station parameters to compare against the server (see sync_stations), and the arguments used to initialize the posting class (other than the metadata and posting data sources)
+
+# Gets the local station parameters for Hydat stations, named as on the server
+def get_hydat_local_stations(postd2w):
+    local_stations = postd2w.pull_all_from_metadata(['STATION_NAME', 'STATION_STATUS', 'LATITUDE', 'LONGITUDE'])
+    local_stations.columns = ['location_name', 'monitoring_status', 'latitude', 'longitude']
+    return local_stations
+
+# Gets the local station parameters for EC Climate stations, named as on the server. If any of the daily/hourly last years are greater than or equal to the previous year, the station is active (This gives a 1-year leeway period, useful to ignore long periods of missing data/station inactivity)
+def get_ecclimate_local_stations(postd2w):
+    local_stations = postd2w.pull_all_from_metadata(['Name', 'Latitude (Decimal Degrees)', 'Longitude (Decimal Degrees)'])
+    local_stations.columns = ['location_name', 'latitude', 'longitude']
+    isactive = (postd2w.pull_all_from_metadata(['DLY Last Year', 'HLY Last Year']) >= (datetime.today().year - 1)).any(axis=1)
+    local_stations.insert(1, 'monitoring_status', isactive.map({True: 'ACTIVE', False: 'DISCONTINUED'}))
+    return local_stations
+
+# Gets the local station parameters for Pacfish stations, named as on the server. If the last year of data is greater than or equal to the previous year, the station is active (giving a 1-year leeway period)
+def get_pacfish_local_stations(postd2w):
+    local_stations = postd2w.pull_all_from_metadata(['station_name', 'lat', 'long'])
+    local_stations.columns = ['location_name', 'latitude', 'longitude']
+    isactive = postd2w.pull_all_from_metadata(['end_date'])['end_date'].dt.year >= (datetime.today().year - 1)
+    local_stations.insert(1, 'monitoring_status', isactive.map({True: 'ACTIVE', False: 'DISCONTINUED'}))
+    return local_stations
+
+# Hydat
+HYDAT_CONFIG = {
+    # The D2W owner ID for this database
+    'owner_id': 7,
+    'station_mapping': get_surface_water_station_mapping,
+    'local_stations': get_hydat_local_stations,
+    'postd2w': dict(
+        # Basic attributes
+        schema='hydat',
+        monitoring_type='SURFACE_WATER',
+        # Type specifications for metadata and posting data
+        metadata_dtypes={
+            'STATION_NUMBER': 'str',
+            'STATION_NAME': 'str',
+            'STATION_STATUS': 'str',
+            'DRAINAGE_AREA_GROSS': 'float64',
+            'DRAINAGE_AREA_EFFECT': 'float64',
+            'RHBN': 'str',
+            'REAL_TIME': 'str',
+            'LATITUDE': 'float64',
+            'LONGITUDE': 'float64',
+            'DATUM_ID':'float64'
+        },
+        postdf_dtypes={
+            'STATION_NUMBER': 'str',
+            'Date': 'datetime64',
+            'flow': 'float64',
+            'level': 'float64',
+            'pub_status': 'str'
+        },
+        # Column that uniquely identifies stations in the metadata table
+        metadata_statcol='STATION_NUMBER',
+        # Column that uniquely identifies stations in the posting table
+        postdf_statcol='STATION_NUMBER',
+        # Column that uniquely identifies dates in the posting table
+        postdf_datecol='Date',
+        # A mapping dictionary connecting column names in the d2w server to column names in the posting file. 
+        ps_col_mappings={
+            'station_id':'STATION_NUMBER',
+            'datetime': 'Date',
+            'water_flow_calibrated_mps': 'flow', 
+            'water_level_staff_gauge_calibrated': 'level', 
+            'published': 'pub_status'
+        }
+    )
+}
+
+# EC Climate
+ECCLIMATE_CONFIG = {
+    # The D2W owner ID for this database
+    'owner_id': 8,
+    'station_mapping': get_climate_station_mapping,
+    'local_stations': get_ecclimate_local_stations,
+    'postd2w': dict(
+        # Basic attributes
+        schema='ecclimate',
+        monitoring_type='CLIMATE',
+        # Type specifications for metadata and posting data
+        metadata_dtypes={
+            'Name': 'str',
+            'Province': 'str',
+            'Climate ID': 'str',
+            'Station ID': 'str',
+            'WMO ID': 'str',
+            'TC ID': 'str',
+            'Latitude (Decimal Degrees)': 'float64',
+            'Longitude (Decimal Degrees)': 'float64',
+            'Latitude': 'float64',
+            'Longitude': 'float64',
+            'Elevation (m)': 'float64',
+            'First Year': 'int64',
+            'Last Year': 'int64',
+            'HLY First Year': 'float64',
+            'HLY Last Year': 'float64',
+            'DLY First Year': 'float64',
+            'DLY Last Year': 'float64',
+            'MLY First Year': 'float64',
+            'MLY Last Year': 'float64',
+        },
+        postdf_dtypes={
+            'ec_station_id': 'str',
+            'station_name': 'str',
+            'datetime': 'datetime64',
+            'max_temp': 'float64',
+            'max_temp_flag': 'str',
+            'min_temp': 'float64',
+            'min_temp_flag': 'str',
+            'mean_temp': 'float64',
+            'mean_temp_flag': 'str',
+            'heat_deg_days': 'float64', 
+            'heat_deg_days_flag': 'str',
+            'cool_deg_days': 'float64', 
+            'cool_deg_days_flag': 'str', 
+            'total_rain': 'float64', 
+            'total_rain_flag': 'str',  
+            'total_snow': 'float64', 
+            'total_snow_flag': 'str', 
+            'total_precip': 'float64', 
+            'total_precip_flag': 'str', 
+            'snow_on_grnd': 'float64', 
+            'snow_on_grnd_flag': 'str', 
+            'dir_of_max_gust': 'float64', 
+            'dir_of_max_gust_flag': 'str', 
+            'spd_of_max_gust': 'float64', 
+            'spd_of_max_gust_flag': 'str'
+        },
+        # Column that uniquely identifies stations in the metadata table
+        metadata_statcol='Station ID',
+        # Column that uniquely identifies stations in the posting table
+        postdf_statcol='ec_station_id',
+        # Column that uniquely identifies dates in the posting table
+        postdf_datecol='datetime',
+        # A mapping dictionary connecting column names in the d2w server to column names in the posting file. 
+        ps_col_mappings={
+            'station_id':'ec_station_id',
+            'datetime': 'datetime',
+            'location_name': 'station_name',
+            'max_temperature_c': 'max_temp', 
+            'max_temp_flag': 'max_temp_flag', 
+            'min_temperature_c': 'min_temp', 
+            'min_temperature_flag': 'min_temp_flag', 
+            'mean_temperature_c': 'mean_temp', 
+            'mean_temperature_flag': 'mean_temp_flag', 
+            'heat_degree_days_c': 'heat_deg_days', 
+            'heat_degree_days_flag': 'heat_deg_days_flag', 
+            'cool_degree_days_c': 'cool_deg_days', 
+            'cool_degree_days_flag': 'cool_deg_days_flag', 
+            'total_rain_mm': 'total_rain', 
+            'total_rain_flag': 'total_rain_flag', 
+            'total_snow_cm': 'total_snow', 
+            'total_snow_flag': 'total_snow_flag', 
+            'total_precipitation_mm': 'total_precip', 
+            'total_precipitation_flag': 'total_precip_flag', 
+            'snow_on_ground_cm': 'snow_on_grnd', 
+            'snow_on_ground_flag': 'snow_on_grnd_flag', 
+            'direction_max_gust_tens_degree': 'dir_of_max_gust', 
+            'direction_max_gust_flag': 'dir_of_max_gust_flag', 
+            'speed_max_gust_kmh': 'spd_of_max_gust', 
+            'speed_max_gust_flag': 'spd_of_max_gust_flag',
+        }
+    )
+}
+
+# Pacfish
+PACFISH_CONFIG = {
+    # The D2W owner ID for this database
+    'owner_id': 9,
+    'station_mapping': get_surface_water_station_mapping,
+    'local_stations': get_pacfish_local_stations,
+    'postd2w': dict(
+        # Basic attributes
+        schema='pacfish',
+        monitoring_type='SURFACE_WATER',
+        # Type specifications for metadata and posting data
+        metadata_dtypes={
+            'station_id': 'str',
+            'station_name': 'str',
+            'station_url_name': 'str',
+            'start_date': 'datetime64',
+            'end_date': 'datetime64',
+            'water_temperature': 'bool',
+            'staff_gauge': 'bool',
+            'voltage': 'bool',
+            'barometric_pressure': 'bool',
+            'lat': 'float64',
+            'long': 'float64',
+            'site_info': 'str'
+        },
+        postdf_dtypes={
+            'station_number': 'str',
+            'station_name': 'str',
+            'datetime': 'datetime64',
+            'pressure': 'float64',
+            'sensor_depth': 'float64',
+            'water_level': 'float64',
+            'water_temperature': 'float64',
+        },
+        # Column that uniquely identifies stations in the metadata table
+        metadata_statcol='station_id',
+        # Column that uniquely identifies stations in the posting table
+        postdf_statcol='station_number',
+        # Column that uniquely identifies dates in the posting table
+        postdf_datecol='datetime',
+        # A mapping dictionary connecting column names in the d2w server to column names in the posting file. 
+        ps_col_mappings={
+            'station_id':'station_number',
+            'location_name': 'station_name',
+            'datetime': 'datetime',
+            'water_level_staff_gauge_calibrated': 'water_level',
+            'water_level_compensated_m': 'sensor_depth',
+            'temperature_c': 'water_temperature',
+            'barometric_pressure_m': 'pressure',
+        }
+    )
+}
+
+# Configurations by schema name
+POST_CONFIGS = {
+    'hydat': HYDAT_CONFIG,
+    'ecclimate': ECCLIMATE_CONFIG,
+    'pacfish': PACFISH_CONFIG
+}
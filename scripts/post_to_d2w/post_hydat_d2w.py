@@ -3,13 +3,21 @@ import os
 from pathlib import Path
 os.chdir(Path(__file__).parent.parent.parent)
 import logging
-import pandas as pd
+import asyncio
 from json import load
 from optparse import OptionParser
 from datetime import datetime, timedelta
 from scripts.post_to_d2w.PostD2W import PostD2W
+from scripts.post_to_d2w.ServerMirror import ServerMirror
+from scripts.post_to_d2w.AsyncD2WClient import AsyncD2WClient
+from scripts.post_to_d2w.ThrottledClient import ThrottledClient
+from scripts.post_to_d2w.RunJournal import RunJournal
+from scripts.post_to_d2w.RunMetrics import RunMetrics
+from scripts.post_to_d2w.MeteredClient import MeteredClient
 from scripts.post_to_d2w.post_utils import *
-from depth2water import create_client, get_surface_water_mapping, get_surface_water_station_mapping
+from scripts.post_to_d2w.post_configs import POST_CONFIGS
+from scripts.gather_new_data.gather_utils import WATERMARK_KEYS, commit_watermark
+from depth2water import create_client, get_surface_water_mapping
 
 #%% Initializing option parsing
 parser = OptionParser()
@@ -23,6 +31,71 @@ parser.add_option(
     dest="enddate",
     default=datetime.today().strftime("%Y-%m-%dT00:00:00-00:00"),
     help="The end date of the date range for which data are being posted. Defaults to today")
+parser.add_option(
+    "-w", "--workers", 
+    dest="workers",
+    type="int",
+    default=1,
+    help="The number of stations to reconcile concurrently against the d2w server. Defaults to 1 (sequential)")
+parser.add_option(
+    "-b", "--bulk-fetch", 
+    dest="bulk_fetch",
+    action="store_true",
+    default=False,
+    help="Fetch existing server data for all stations in a single windowed query, rather than one query per station")
+parser.add_option(
+    "--batch-size", 
+    dest="batch_size",
+    type="int",
+    default=100,
+    help="The number of changed rows queued per batch of update requests. Defaults to 100")
+parser.add_option(
+    "--max-in-flight", 
+    dest="max_in_flight",
+    type="int",
+    default=1,
+    help="The maximum number of update requests sent to the d2w server at once. Defaults to 1 (sequential)")
+parser.add_option(
+    "-a", "--async-requests", 
+    dest="async_requests",
+    type="int",
+    default=None,
+    help="Reconcile stations on an event loop with up to this many requests in flight to the d2w server at once (e.g several hundred), rather than on worker threads. The workers, batch size and max in-flight options are then ignored")
+parser.add_option(
+    "-r", "--rate-control", 
+    dest="rate_control",
+    action="store_true",
+    default=False,
+    help="Send all d2w requests through an adaptive rate controller, which adjusts the number of concurrent requests to what the server allows, retries throttled (429/503) and failed (5xx) requests with backoff, and pauses requests if the server keeps failing")
+parser.add_option(
+    "-m", "--mirror", 
+    dest="mirror",
+    action="store_true",
+    default=False,
+    help="Keep a local mirror of the server data in the temporary directory, and only fetch data that is missing from it or stale")
+parser.add_option(
+    "--mirror-max-age", 
+    dest="mirror_max_age",
+    type="int",
+    default=7,
+    help="The number of days after which mirrored server data is considered stale and fetched again. Defaults to 7")
+parser.add_option(
+    "--resume", 
+    dest="resume",
+    action="store_true",
+    default=False,
+    help="Resume an interrupted run with the same date range, skipping the stations and updates its journal records as complete")
+parser.add_option(
+    "--metrics-dir", 
+    dest="metrics_dir",
+    default=None,
+    help="Record the time spent in each phase, API calls and latencies by endpoint, bytes transferred and row counts, and write them to this directory as a JSON run report and a Prometheus textfile (e.g the node exporter's textfile directory). By default no metrics are recorded")
+parser.add_option(
+    "-f", "--format", 
+    dest="format",
+    default="csv",
+    choices=["csv", "parquet"],
+    help="The file format of the daily data exported by the gather scripts, either csv or parquet. Defaults to csv")
 (options, args) = parser.parse_args()
 
 # %% ===== Paths and global variables =====
@@ -30,8 +103,9 @@ parser.add_option(
 # Which database is being update?
 schema = 'hydat'
 
-# The D2W owner ID for this database
-OWNER_ID = 7
+# Posting settings for this database, and its D2W owner ID
+config = POST_CONFIGS[schema]
+OWNER_ID = config['owner_id']
 
 # Client credentials from JSON
 creds = load(open('options/client_credentials.json',))
@@ -43,55 +117,35 @@ fpaths = load(open('options/filepaths.json', ))
 station_file_path = fpaths[schema + '-metadata']
 
 # Path to daily data file
-daily_data_path = fpaths['update-data-dir'] + '/' + schema + '-daily.csv'
+daily_data_path = fpaths['update-data-dir'] + '/' + schema + '-daily.' + options.format
 
 # Path to temporary directory for storing posting files
 data_temp_path = fpaths['temp-dir'] + '/' + schema
 
+# Path to the local mirror of server data
+mirror_path = fpaths['temp-dir'] + '/' + schema + '-mirror.sqlite'
+
+# Path to the journal of completed work, for resuming interrupted runs
+journal_path = fpaths['temp-dir'] + '/' + schema + '-journal.jsonl'
+
+# Path to the file storing the watermarks of incremental exports (see gather_new_data)
+watermark_path = fpaths['temp-dir'] + '/watermarks.json'
+
+
+# %% ===== Initializing run metrics =====
+metrics = RunMetrics(schema) if options.metrics_dir is not None else None
 
 # %% ===== Initializing posting class =====
-postd2w = PostD2W(
-    # Basic attributes
-    schema=schema,
-    monitoring_type='SURFACE_WATER',
-    # Paths to metadata and update/posting data
-    metadata_path = station_file_path,
-    postdf_path = daily_data_path,
-    # Type specifications for metadata and posting data
-    metadata_dtypes = {
-        'STATION_NUMBER': 'str',
-        'STATION_NAME': 'str',
-        'STATION_STATUS': 'str',
-        'DRAINAGE_AREA_GROSS': 'float64',
-        'DRAINAGE_AREA_EFFECT': 'float64',
-        'RHBN': 'str',
-        'REAL_TIME': 'str',
-        'LATITUDE': 'float64',
-        'LONGITUDE': 'float64',
-        'DATUM_ID':'float64'
-    },
-    postdf_dtypes={
-        'STATION_NUMBER': 'str',
-        'Date': 'datetime64',
-        'flow': 'float64',
-        'level': 'float64',
-        'pub_status': 'str'
-    },
-    # Column that uniquely identifies stations in the metadata table
-    metadata_statcol='STATION_NUMBER',
-    # Column that uniquely identifies stations in the posting table
-    postdf_statcol='STATION_NUMBER',
-    # Column that uniquely identifies dates in the posting table
-    postdf_datecol='Date',
-    # A mapping dictionary connecting column names in the d2w server to column names in the posting file. 
-    ps_col_mappings={
-        'station_id':'STATION_NUMBER',
-        'datetime': 'Date',
-        'water_flow_calibrated_mps': 'flow', 
-        'water_level_staff_gauge_calibrated': 'level', 
-        'published': 'pub_status'
-    }
-)
+with timed_phase(metrics, 'load'):
+    postd2w = PostD2W(
+        # Paths to metadata and update/posting data
+        metadata_path = station_file_path,
+        postdf_path = daily_data_path,
+        # Basic attributes, types, identifying columns and column mappings
+        **config['postd2w']
+    )
+if metrics is not None:
+    metrics.add('rows_loaded', 0 if postd2w.postdf is None else postd2w.postdf.shape[0])
 # %% ===== Initializing client =====
 
 # Setting up logging
@@ -107,6 +161,14 @@ client = create_client(
     scheme=creds['scheme']
 )
 
+# Optionally counting and timing every request made by the client (every attempt, including retries)
+if metrics is not None:
+    client = MeteredClient(client, metrics)
+
+# Optionally wrapping the client with adaptive rate control, retries and a circuit breaker
+if options.rate_control:
+    client = ThrottledClient(client)
+
 #%% Manual data inputs - for use when script testing
 # start_date = (datetime.today() - timedelta(days=331)).strftime("%Y-%m-%dT00:00:00-00:00")
 # end_date =datetime.today().strftime("%Y-%m-%dT00:00:00-00:00")
@@ -119,157 +181,64 @@ end_date = options.enddate
 print('Start Date: ' + start_date)
 print('End Date: ' + end_date)
 
-# %% ===== Checking stations on d2w =====
+# Opening the journal of completed work. Without --resume (or for a different run) any previous journal is replaced
+journal = RunJournal(journal_path, {'schema': schema, 'start_date': start_date, 'end_date': end_date}, resume=options.resume)
+if journal.resumed:
+    print('Resuming from journal: ' + str(len(journal.stations)) + ' stations already complete')
 
-# Getting unique station IDs from the metadata file:
-stat_ids = postd2w.metadata[postd2w.metadata_statcol].unique()
-
-for stat in stat_ids:
-    # Checking if the station is present
-    result = client.get_station_by_station_id(stat, monitoring_type=postd2w.monitoring_type)
-     # Removing results that are not surface water stations
-    # result['results'] = [station for station in result['results'] if station['monitoring_type'] == postd2w.monitoring_type]
-    # If not, creating it
-    if len(result['results']) == 0:
-        print('Creating station ' + stat)
-        station_mapping = get_surface_water_station_mapping({
-            'station_id': stat,
-            'owner': OWNER_ID,
-            'location_name': postd2w.pull_from_metadata(stat, 'STATION_NAME'),
-            'longitude': postd2w.pull_from_metadata(stat, 'LONGITUDE'),
-            'latitude': postd2w.pull_from_metadata(stat, 'LATITUDE'),
-            'prov_terr_state_lc': 'BC'
-        })
-        new_station = client.create_station(station_mapping)
-    else:
-        print('Station ' + stat + ' already present')
-        # Getting relevant parameters from the local metadata file for comparison
-        metaparams = {
-            # Getting either active/discontinued status from isactive
-            'station_status': postd2w.pull_from_metadata(stat, 'STATION_STATUS'),
-            'lat': postd2w.pull_from_metadata(stat, 'LATITUDE'),
-            'long': postd2w.pull_from_metadata(stat, 'LONGITUDE')
-        }
-         # If any of the parameters are not the same between metadata and those stored on file, updating
-        isdiscrepant = any([
-            metaparams['station_status'] != pull_from_query(result, 'monitoring_status'),
-            metaparams['long'] != pull_from_query(result, 'longitude'),
-            metaparams['lat']!= pull_from_query(result, 'latitude')
-        ])
-        if isdiscrepant:
-            print('Station status has changed - updating...')
-            updict = result['results'][0]
-            # updict['owner'] = OWNER_ID
-            # updict['monitoring_status'] = emptyIfNan(metaparams['station_status'])
-            # updict['longitude'] = emptyIfNan(metaparams['long'])
-            # updict['latitude'] = emptyIfNan(metaparams['lat'])
-            updict['monitoring_status'] = metaparams['station_status']
-            updict['longitude'] = metaparams['long']
-            updict['latitude'] = metaparams['lat']
-            client.update_station(id=updict['id'], data=updict)
-        else:
-            print('No changes made to station ' + stat)
+# %% ===== Checking stations on d2w =====
 
+# Creating stations missing from the server, and updating those whose parameters differ from the local metadata file
+with timed_phase(metrics, 'station_sync'):
+    sync_stations(client, OWNER_ID, postd2w.monitoring_type, config['local_stations'](postd2w), config['station_mapping'])
 print('Station updates complete')
 
 # %% ===== Categorizing new data for update or post =====
+results = []
 if postd2w.postdf is None:
     print('No daily data available in this time range. Skipping data update...')
 else:
-    # Getting the station of ids of all stations included in the current update dataset
-    stat_ids = postd2w.postdf[postd2w.postdf_statcol].unique()
-    for stat in stat_ids:
-        print(stat)
-        # Getting all the new data for this station
-        updatedf = postd2w.postdf[postd2w.postdf[postd2w.postdf_statcol] == stat]
-        
-        # Getting all current data for the station within the data range
-        raw_resp = get_server_data_multipage(
-            client=client,
-            monitoring_type=postd2w.monitoring_type,
-            station_id=stat, 
-            start_date=(pd.to_datetime(start_date) - timedelta(days=1)).strftime("%Y-%m-%dT00:00:00-00:00"), 
-            end_date=(pd.to_datetime(end_date) + timedelta(days=1)).strftime("%Y-%m-%dT00:00:00-00:00")
-        )
-
-        # If there is no current data present, just pushing new data directly to a csv to be posted (i.e no direct database updates required)
-        if len(raw_resp) == 0:
-            # Writing all new data to csv for posting
-            if updatedf.shape[0] > 0:
-                print('No existing data in this time period for station ' + stat + '. Writing all new data to post...')
-                fpath = data_temp_path + '/' + stat + '_' + datetime.today().strftime('%Y-%m-%d') + '.csv'
-                updatedf.to_csv(fpath, index=False)
-            else:
-                print('No rows to post for station ' + stat)
-            # Skipping iteration to the next station, as no updates are needed
-            continue
-
-        # Simplifying the response data dictionary
-        keylist = ['station_id','location_name']
-        curr_data = [simplify_queried_dict(datadict, keylist) for datadict in raw_resp]
-
-        # Converting to dataframe
-        querydf = pd.DataFrame(curr_data, index = None)
-
-        # Formatting to match the update data
-        querydf = format_queried_df(
-            querydf=querydf, 
-            cols_dict=postd2w.ps_col_mappings,
-            dtype_dict=postd2w.postdf_dtypes,
-            dtime_col=postd2w.postdf_datecol
-        )
-
-        # Separating rows that are totally new and need to be added (via a post) from those that already exist but have changed (need to be updated)
-        (addrows, updaterows) = separate_add_vs_update_rows(
-            updatedf=updatedf, 
-            querydf=querydf, 
-            statid_col=postd2w.postdf_statcol, 
-            dtime_col=postd2w.postdf_datecol,
-            collist = list(postd2w.ps_col_mappings.values()),
-            statname_col = None
-        )
-
-        # For each rows that needs updating:
-        for i in range(0, updaterows.shape[0]):
-            # Getting the date of the update row
-            querydate = updaterows.iloc[i,][postd2w.postdf_datecol]
-            
-            # Obtaining the data dictionary already stored on the server for this date
-            updict = dict()
-            for row in curr_data:
-                if pd.to_datetime(row['datetime']).strftime('%Y-%m-%d') == querydate.strftime('%Y-%m-%d'):
-                    updict = row
-                    break
-            
-            # Converting the update row to a dictionary (easier to pull out values)
-            valuedict = updaterows.to_dict('records')[i]
-            # Removing the ID and date columns - don't want these to constantly change.
-            valuedict.pop(postd2w.postdf_statcol)
-            valuedict.pop(postd2w.postdf_datecol)
-            # Also removing the location name column, as this is set by the station table and so updates here are redundant
-            if postd2w.ps_col_mappings['location_name'] in valuedict.keys():
-                valuedict.pop(postd2w.ps_col_mappings['location_name'])
-
-            # Updating values for every shared column (based on the provided mappings dictionary)
-            for key, value in postd2w.ps_col_mappings.items():
-                if(value not in valuedict.keys()): continue
-                # updict[key] = emptyIfNan(valuedict[value])
-                updict[key] = valuedict[value]
-            
-            # Posting updates
-            client.update_surface_water_data(updict['id'], updict)
-        else:
-            print(str(updaterows.shape[0]) + ' rows updated for station ' + stat)
-
-        # For those that are simple additions, writing to csv for posting
-        if addrows.shape[0] > 0:
-            fpath = data_temp_path + '/' + stat + '_' + datetime.today().strftime('%Y-%m-%d') + '.csv'
-            addrows.to_csv(fpath, index=False)
-            print(str(addrows.shape[0]) + ' rows to post for station ' + stat)
-        else:
-            print('0 rows to post for station ' + stat)
-
+    # Optionally opening the local mirror of server data
+    mirror = ServerMirror(mirror_path, postd2w.monitoring_type, max_age_days=options.mirror_max_age) if options.mirror else None
+
+    if options.async_requests is not None:
+        # Reconciling each station's new data against the server on an event loop, through the asynchronous client adapter
+        with timed_phase(metrics, 'reconcile'), AsyncD2WClient(client, max_concurrency=options.async_requests) as aclient:
+            results = asyncio.run(reconcile_stations_async(
+                aclient=aclient,
+                postd2w=postd2w,
+                start_date=start_date,
+                end_date=end_date,
+                data_temp_path=data_temp_path,
+                bulk_fetch=options.bulk_fetch,
+                owner=OWNER_ID,
+                mirror=mirror,
+                journal=journal,
+                metrics=metrics
+            ))
+    else:
+        # Reconciling each station's new data against the server, on a pool of worker threads
+        with timed_phase(metrics, 'reconcile'):
+            results = reconcile_stations(
+                client=client,
+                postd2w=postd2w,
+                start_date=start_date,
+                end_date=end_date,
+                data_temp_path=data_temp_path,
+                workers=options.workers,
+                bulk_fetch=options.bulk_fetch,
+                owner=OWNER_ID,
+                update_batch_size=options.batch_size,
+                max_in_flight=options.max_in_flight,
+                mirror=mirror,
+                journal=journal,
+                metrics=metrics
+            )
+    if mirror is not None:
+        mirror.close()
     print('Time series updates complete')
+    if options.rate_control:
+        print(client)
 
 # %% ===== Posting new data csvs =====
 
@@ -283,6 +252,8 @@ file_mappings.update({
 # File names of posting csvs
 fnames = [file for file in os.listdir(data_temp_path) if file.endswith('csv')]
 
+# Uploading new data is currently disabled, so the posting csvs are left in the temporary directory. When it is re-enabled, each uploaded file is recorded in the run journal so that a resumed run (--resume) does not upload it again
+
 # # Empty list to store the filenames of cleaning CSV
 # fclean = []
 # errstats = []
@@ -293,12 +264,19 @@ fnames = [file for file in os.listdir(data_temp_path) if file.endswith('csv')]
 #     # Calling the client to post each file
 #     for name in fnames:
 #         fpath = data_temp_path + '/' + name
+#         # Skipping files uploaded before an interrupted run was stopped
+#         if journal.is_uploaded(name):
+#             print('Already uploaded file: ' + name)
+#             fclean.extend([name])
+#             continue
 #         try:
-#             client.post_csv_file(fpath, get_surface_water_mapping(file_mappings))
+#             with timed_phase(metrics, 'upload'):
+#                 client.post_csv_file(fpath, get_surface_water_mapping(file_mappings))
+#             journal.record_upload(name)
 #             fclean.extend([name])
 #             print('Uploaded new data from file: ' + name)
-#         except:
-#             print('Error with station: ' + name)
+#         except Exception as e:
+#             print('Error with station: ' + name + ': ' + repr(e))
 #             errstats.extend([name])
 #     print('Completed new data posting')
 
@@ -306,4 +284,19 @@ fnames = [file for file in os.listdir(data_temp_path) if file.endswith('csv')]
 # for name in fclean:
 #     print('Cleaning file: ' + name)
 #     os.remove(data_temp_path + '/' + name)
+
+# Closing the journal
+journal.close()
+
+# Committing the watermark of the incremental export once all of its stations have been posted without errors, so that the next incremental export only selects rows changed since it. Otherwise the next export includes these rows again. A daily data file that could not be read is not a successful post: the watermark is only committed if this run loaded the exported file, or if the export was empty (see commit_watermark)
+if any(result['error'] is not None for result in results):
+    print('Some stations failed to post. Keeping the previous incremental export watermark')
+elif commit_watermark(watermark_path, WATERMARK_KEYS[schema], loaded_path=daily_data_path if postd2w.postdf is not None else None):
+    print('Committed the incremental export watermark')
+
+# Writing the run report and Prometheus textfile
+if metrics is not None:
+    (report_path, prom_path) = metrics.write(options.metrics_dir)
+    print(metrics)
+    print('Wrote run report to ' + report_path + ' and metrics to ' + prom_path)
 # %%
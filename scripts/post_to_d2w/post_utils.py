@@ -1,5 +1,12 @@
-from numpy import isnan, nan
+import asyncio
+from collections import deque
+from itertools import chain
+from contextlib import nullcontext
+from numpy import isnan, isclose
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
+from scripts.post_to_d2w.UpdateSubmitter import UpdateSubmitter
 
 # Helper function to quickly access values from a "result" dictionary, obtained from a station-specific d2w query
 def pull_from_query(resultobj, varname, roundfigs=5):
@@ -17,20 +24,168 @@ def emptyIfNan(x):
     else:
         return x
 
-def get_server_data_multipage(client, monitoring_type, station_id, start_date=None, end_date=None, url=None):
+# Fetches a single page of time series data from the d2w server, either from a query or from the "next" link of a previous page. The owner filter is only passed to the client when one is given
+def get_server_data_page(client, monitoring_type, station_id=None, start_date=None, end_date=None, url=None, owner=None):
+    filters = dict() if owner is None else {'owner': owner}
     # Different get function for different data types
     if(monitoring_type == 'SURFACE_WATER'):    
-        resp = client.get_surface_water_data(station_id=station_id, start_date=start_date, end_date=end_date, url=url)
+        return client.get_surface_water_data(station_id=station_id, start_date=start_date, end_date=end_date, url=url, **filters)
     elif(monitoring_type == 'CLIMATE'):
-        resp = client.get_climate_data(station_id=station_id, start_date=start_date, end_date=end_date, url=url)
-    outdata = resp['results']
-    # Calling the function recursively to get the next page if present
-    if resp['next'] is not None:
-        print('There is another page, getting its data...')
-        outdata.extend(get_server_data_multipage(client, monitoring_type, station_id, url=resp['next']))
+        return client.get_climate_data(station_id=station_id, start_date=start_date, end_date=end_date, url=url, **filters)
+    else:
+        raise ValueError('Unsupported monitoring type: ' + str(monitoring_type))
+
+# Generator that yields the results of each page of a d2w data query as it arrives. The next page is requested in the background while the caller is still processing the current one. Iteration can be capped by a maximum number of pages and/or records, so that very long histories can be streamed without holding everything in memory
+def iter_server_data_pages(client, monitoring_type, station_id, start_date=None, end_date=None, url=None, max_pages=None, max_records=None, owner=None):
+    npages = 0
+    nrecords = 0
+    # A single background thread is enough to keep one page in flight ahead of the caller
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        future = pool.submit(get_server_data_page, client, monitoring_type, station_id, start_date, end_date, url, owner)
+        while future is not None:
+            resp = future.result()
+            npages += 1
+            nrecords += len(resp['results'])
+            # Prefetching the next page (if present, and if the caps have not been reached) before handing this one over
+            more = all([
+                resp['next'] is not None,
+                max_pages is None or npages < max_pages,
+                max_records is None or nrecords < max_records
+            ])
+            future = pool.submit(get_server_data_page, client, monitoring_type, station_id, url=resp['next']) if more else None
+            yield resp['results']
+
+# Generator that yields individual records from a d2w data query, page by page
+def iter_server_data_records(client, monitoring_type, station_id, start_date=None, end_date=None, max_pages=None, max_records=None, owner=None):
+    for page in iter_server_data_pages(client, monitoring_type, station_id, start_date, end_date, max_pages=max_pages, max_records=max_records, owner=owner):
+        yield from page
+
+def get_server_data_multipage(client, monitoring_type, station_id, start_date=None, end_date=None, url=None):
+    # Iterating over all pages and collecting the results into a single list
+    outdata = []
+    for page in iter_server_data_pages(client, monitoring_type, station_id, start_date, end_date, url):
+        outdata.extend(page)
     # Returning the full queried data dictionary
     return outdata
 
+# Fetches an owner's time series data on the d2w server within a date window in a single paged query (rather than one query per station), and splits the records locally by station ID. Only stations in the provided list are kept. If the client doesn't support filtering data by owner, each of the listed stations is queried individually instead, so that other owners' data is never fetched. Returns a dictionary of station ID to the list of raw records for that station
+def get_server_data_bulk(client, monitoring_type, owner, station_ids, start_date=None, end_date=None):
+    bystation = {stat: [] for stat in station_ids}
+    # Probing whether the client supports the owner filter with the first page only, so that errors from later pages or from the records themselves are raised rather than mistaken for a missing filter
+    try:
+        first = get_server_data_page(client, monitoring_type, None, start_date, end_date, owner=owner)
+    except TypeError as e:
+        print('Owner data query unavailable (' + repr(e) + '). Fetching stations individually...')
+        for stat in bystation:
+            bystation[stat] = get_server_data_multipage(client, monitoring_type, stat, start_date, end_date)
+        return bystation
+    # Following the "next" links of the first page, which carry the owner filter
+    pages = [first['results']]
+    if first['next'] is not None:
+        pages = chain(pages, iter_server_data_pages(client, monitoring_type, None, url=first['next']))
+    for page in pages:
+        for record in page:
+            stat = record['station']['station_id']
+            if stat in bystation:
+                bystation[stat].append(record)
+    return bystation
+
+# Pads a date range by a day on either side, to ensure all data within the range is captured by server queries. Returns the padded start and end dates, as a tuple
+def query_date_range(start_date, end_date):
+    query_start = (pd.to_datetime(start_date) - timedelta(days=1)).strftime("%Y-%m-%dT00:00:00-00:00")
+    query_end = (pd.to_datetime(end_date) + timedelta(days=1)).strftime("%Y-%m-%dT00:00:00-00:00")
+    return (query_start, query_end)
+
+# Gets a station's server data within a date range through a local mirror of the server (see ServerMirror). Only the dates that are missing or stale in the mirror are fetched from the server, as one contiguous range, and the full range is then read back from the mirror
+def get_server_data_mirrored(client, mirror, monitoring_type, station_id, start_date, end_date):
+    missing = mirror.missing_dates(station_id, start_date, end_date)
+    if len(missing) > 0:
+        (query_start, query_end) = query_date_range(missing[0], missing[-1])
+        records = get_server_data_multipage(client, monitoring_type, station_id, query_start, query_end)
+        mirror.store(station_id, records, pd.date_range(missing[0], missing[-1]).strftime('%Y-%m-%d'))
+    return mirror.load(station_id, start_date, end_date)
+
+# Lists every station on the d2w server for an owner and monitoring type, following the pagination links, and returns them as a dictionary keyed by station ID. This replaces one station-by-station lookup per station with a handful of paged requests
+def list_server_stations(client, owner, monitoring_type):
+    stations = dict()
+    resp = client.get_stations(owner=owner, monitoring_type=monitoring_type)
+    while True:
+        for station in resp['results']:
+            stations[station['station_id']] = station
+        # Stopping once there are no more pages
+        if resp['next'] is None: break
+        resp = client.get_stations(url=resp['next'])
+    return stations
+
+# Looks up each of the given stations on the d2w server one at a time, and returns those found as a dictionary keyed by station ID
+def lookup_server_stations(client, monitoring_type, station_ids):
+    stations = dict()
+    for stat in station_ids:
+        result = client.get_station_by_station_id(stat, monitoring_type=monitoring_type)
+        if len(result['results']) > 0:
+            stations[stat] = result['results'][0]
+    return stations
+
+# Gets the stations on the d2w server for an owner and monitoring type as a dictionary keyed by station ID, from the paged station listing (see list_server_stations). If the client doesn't support listing stations by owner, or the listing isn't in the expected paged format, each of the given station IDs is looked up individually instead
+def get_server_stations(client, owner, monitoring_type, station_ids):
+    try:
+        return list_server_stations(client, owner, monitoring_type)
+    except (AttributeError, TypeError, KeyError) as e:
+        print('Station listing unavailable (' + repr(e) + '). Looking up stations individually...')
+        return lookup_server_stations(client, monitoring_type, station_ids)
+
+# Compares local station attributes against the stations listed on the d2w server in a single vectorized pass. The local table must be indexed by station ID and have a column for each of the compared server attributes. Numeric attributes (e.g coordinates) are compared with a tolerance, and missing values on both sides are treated as equal. Returns a tuple of local rows for stations that need to be created, updated, or left unchanged
+def diff_stations(local_stations, server_stations, compare_cols=('monitoring_status', 'latitude', 'longitude'), tolerance=1e-5):
+    # Server stations as a table aligned to the local station IDs
+    serverdf = pd.DataFrame(list(server_stations.values()), columns=['station_id'] + list(compare_cols)).set_index('station_id')
+    exists = local_stations.index.isin(serverdf.index)
+    matched = local_stations[exists]
+    serverdf = serverdf.reindex(matched.index)
+
+    # Flagging stations where any of the compared attributes differ
+    isdiscrepant = pd.Series(False, index=matched.index)
+    for col in compare_cols:
+        if pd.api.types.is_numeric_dtype(matched[col]):
+            same = isclose(matched[col].astype('float64'), pd.to_numeric(serverdf[col], errors='coerce'), rtol=0, atol=tolerance, equal_nan=True)
+        else:
+            same = ((matched[col] == serverdf[col]) | (matched[col].isna() & serverdf[col].isna())).to_numpy()
+        isdiscrepant = isdiscrepant | ~same
+
+    return (local_stations[~exists], matched[isdiscrepant.to_numpy()], matched[~isdiscrepant.to_numpy()])
+
+# Brings the stations on the d2w server in line with the local station table (see diff_stations): missing stations are created using the provided station mapping function, and stations whose status or location has changed are updated. Returns the tuple of created, updated and unchanged local rows
+def sync_stations(client, owner, monitoring_type, local_stations, station_mapping_fn):
+    # Getting all stations already on the server for this owner, indexed by station ID
+    server_stations = get_server_stations(client, owner=owner, monitoring_type=monitoring_type, station_ids=local_stations.index)
+
+    # Separating stations that are missing on the server (need to be created) from those where any of the parameters are not the same between metadata and those stored on file (need to be updated)
+    (createstats, updatestats, unchangedstats) = diff_stations(local_stations, server_stations)
+
+    # Creating missing stations
+    for stat, row in createstats.iterrows():
+        print('Creating station ' + stat)
+        station_mapping = station_mapping_fn({
+            'station_id': stat,
+            'owner': owner,
+            'location_name': row['location_name'],
+            'longitude': row['longitude'],
+            'latitude': row['latitude'],
+            'prov_terr_state_lc': 'BC'
+        })
+        client.create_station(station_mapping)
+
+    # Updating stations whose status has changed
+    for stat, row in updatestats.iterrows():
+        print('Station status has changed for station ' + stat + ' - updating...')
+        updict = server_stations[stat]
+        updict['monitoring_status'] = row['monitoring_status']
+        updict['longitude'] = row['longitude']
+        updict['latitude'] = row['latitude']
+        client.update_station(id=updict['id'], data=updict)
+
+    print('No changes made to ' + str(unchangedstats.shape[0]) + ' stations')
+    return (createstats, updatestats, unchangedstats)
+
 # Individual data points are returned as dictionaries when the d2w server is queried, and each dictionary contains a subdirectory called "station", where the metadata is stored. This function simplifies a d2w data dictionary to a non-nested, by removing only important attributes from station, dropping the rest, and placing the attributes back at the same level as the rest of the data. 
 def simplify_queried_dict(datadict, keylist):
     # Making a copy prior to manipulation
@@ -61,38 +216,332 @@ def format_queried_df(querydf, cols_dict, dtype_dict, dtime_col):
     qdf.loc[:, dtime_col] = pd.to_datetime(pd.to_datetime(qdf[dtime_col], utc=False).dt.date)
     return qdf
 
+# Computes a 64-bit fingerprint of the values in each row of a dataframe, using pandas' vectorized hashing. Numbers are rounded and "None" strings treated as empty, so that trivial differences between the stored and new versions of a row are ignored
+def row_fingerprints(df, valuecols, roundfigs=5):
+    values = df[valuecols].round(roundfigs)
+    # Adding zero turns the negative zeros that rounding can produce into positive zeros, which hash differently
+    floatcols = values.select_dtypes('float').columns
+    values[floatcols] = values[floatcols] + 0.0
+    # Replacing all "None" characters with empty strings for the sake of comparison
+    objcols = values.select_dtypes('object').columns
+    values[objcols] = values[objcols].replace('None', '')
+    return pd.util.hash_pandas_object(values, index=False).to_numpy()
+
 def separate_add_vs_update_rows(updatedf, querydf, statid_col, dtime_col, collist, statname_col=None, roundfigs=5):
-    # Keeping only columns named in the mappings col-list - these are the only ones that see updates and changes between the new data and the server data
-    updatedf = updatedf[collist]
-    querydf = querydf[collist]
-    
-    # Rounding all numbers to 5 significant figures to make comparisons less subject to small variations
-    updatedf = updatedf.round(roundfigs)
-    querydf = querydf.round(roundfigs)
+    # Rows are identified by station and date. Only the remaining columns named in the mappings col-list are compared between the new data and the server data - the station name is set by the station table, so it is ignored
+    keycols = [statid_col, dtime_col]
+    valuecols = [col for col in collist if col not in keycols + [statname_col]]
 
-    # Replacing all "None" characters with empty strings for the sake of comparison
-    querydf = querydf.replace('None', '')
-    updatedf = updatedf.replace('None', '')
+    # Fingerprinting the values in each row of both tables, and indexing them by station and date
+    updatekeys = pd.MultiIndex.from_frame(updatedf[keycols])
+    querykeys = pd.MultiIndex.from_frame(querydf[keycols])
+    updatehashed = pd.MultiIndex.from_arrays([updatekeys.get_level_values(0), updatekeys.get_level_values(1), row_fingerprints(updatedf, valuecols, roundfigs)])
+    queryhashed = pd.MultiIndex.from_arrays([querykeys.get_level_values(0), querykeys.get_level_values(1), row_fingerprints(querydf, valuecols, roundfigs)])
+
+    # Rows whose station and date are not on the server only exist in the update table, and therefore need to be directly uploaded
+    exists = updatekeys.isin(querykeys)
+    # Rows that exist on the server but whose fingerprint differs have had a value change. In this case, the newly downloaded version takes precedence. Everything else has remained the same
+    unchanged = exists & updatehashed.isin(queryhashed)
+    changed = exists & ~unchanged
+
+    # Subsetting the update table, with the id and datetime columns first. Rounding and "None" replacement are only applied to the returned rows
+    addrows = updatedf.loc[~exists, keycols + [col for col in collist if col not in keycols]].round(roundfigs).replace('None', '').reset_index(drop=True)
+    updaterows = updatedf.loc[changed, keycols + valuecols].round(roundfigs).replace('None', '').reset_index(drop=True)
+
+    # Returning add and update rows, and the number of unchanged rows, as a tuple
+    return (addrows, updaterows, int(unchanged.sum()))
+
+# Indexes simplified server records (see simplify_queried_dict) by their station ID and YMD date, so that the record matching an update row can be found directly rather than by scanning
+def index_server_records(curr_data):
+    dates = pd.to_datetime(pd.Series([row['datetime'] for row in curr_data], dtype='object'))
+    return {(row['station_id'], date.strftime('%Y-%m-%d')): row for row, date in zip(curr_data, dates)}
+
+# Builds the update payload for every row that needs updating in a single pass. Each payload is the server record for the same station and date, with values replaced by those in the update row for every shared column (based on the provided mappings dictionary). The ID, date and station name columns are never updated
+def build_update_payloads(updaterows, server_index, cols_dict, statid_col, dtime_col, statname_col=None):
+    # Server/update column pairs that receive new values
+    valuecols = {key: value for key, value in cols_dict.items() if value in updaterows.columns and value not in [statid_col, dtime_col, statname_col]}
+    # Index keys and values for all update rows, extracted column-wise
+    keys = zip(updaterows[statid_col], updaterows[dtime_col].dt.strftime('%Y-%m-%d'))
+    values = updaterows[list(valuecols.values())].to_dict('records')
+    payloads = []
+    for key, valuedict in zip(keys, values):
+        updict = server_index[key]
+        for serverkey, postkey in valuecols.items():
+            updict[serverkey] = valuedict[postkey]
+        payloads.append(updict)
+    return payloads
+
+# Writes a station's new rows to a csv in the temporary directory for posting, returning the file path
+def write_station_rows(stat, rows, data_temp_path):
+    fpath = data_temp_path + '/' + stat + '_' + datetime.today().strftime('%Y-%m-%d') + '.csv'
+    rows.to_csv(fpath, index=False)
+    return fpath
+
+# Handles a station with no existing data on the server within the date range: all new data is written to csv for posting (i.e no direct database updates required). Returns the station's result, as in reconcile_station
+def post_all_station_rows(postd2w, stat, updatedf, data_temp_path, mirror=None):
+    messages = [stat]
+    if updatedf.shape[0] > 0:
+        messages.append('No existing data in this time period for station ' + stat + '. Writing all new data to post...')
+        write_station_rows(stat, updatedf, data_temp_path)
+        # These dates will change on the server once posted, so the mirror no longer knows their state
+        if mirror is not None:
+            mirror.invalidate(stat, updatedf[postd2w.postdf_datecol].dt.strftime('%Y-%m-%d'))
+    else:
+        messages.append('No rows to post for station ' + stat)
+    return {'station': stat, 'messages': messages, 'added': updatedf.shape[0], 'updated': 0, 'unchanged': 0, 'error': None}
+
+# Compares a station's new data against its existing server records, separating rows that are totally new and need to be added (via a post) from those that already exist but have changed (need to be updated). Returns a tuple of the rows to add, the rows to update, the update payload for each of those rows, and the number of unchanged rows
+def compare_station(postd2w, updatedf, raw_resp):
+    # Simplifying the response data dictionary
+    keylist = ['station_id','location_name']
+    curr_data = [simplify_queried_dict(datadict, keylist) for datadict in raw_resp]
+
+    # Converting to dataframe
+    querydf = pd.DataFrame(curr_data, index = None)
 
-    # Using an indicator left join to see which rows from the update table are new and which already exist
-    left_joined = updatedf.merge(querydf, how='left', indicator=True, on=[statid_col, dtime_col])
+    # Formatting to match the update data
+    querydf = format_queried_df(
+        querydf=querydf, 
+        cols_dict=postd2w.ps_col_mappings,
+        dtype_dict=postd2w.postdf_dtypes,
+        dtime_col=postd2w.postdf_datecol
+    )
 
-    # Those that are "left-only" only exist in the update table, and therefore need to be directly uploaded. First indexing only the id and datetime columns for these rows
-    addrows = left_joined.loc[left_joined._merge == 'left_only', ].loc[:, [statid_col, dtime_col]]
-    # Then taking the rest of the information from the update table
-    addrows = addrows.merge(updatedf, how='left', on=[statid_col, dtime_col])
+    # The station name column (if the posting table has one) is set by the station table, so it is excluded from comparisons and updates
+    statname_col = postd2w.ps_col_mappings.get('location_name')
 
-     # Those that say "both" may need to be updated/edited if any data has changed, not associated with the date/time. Separating only these rows now
-    update_index_table = left_joined.loc[left_joined._merge == 'both', ].loc[:, [statid_col, dtime_col]]
-    update_index_table = update_index_table.merge(updatedf, how='left', on=[statid_col, dtime_col])
+    # Separating rows to add from those to update
+    (addrows, updaterows, nunchanged) = separate_add_vs_update_rows(
+        updatedf=updatedf, 
+        querydf=querydf, 
+        statid_col=postd2w.postdf_statcol, 
+        dtime_col=postd2w.postdf_datecol,
+        collist = list(postd2w.ps_col_mappings.values()),
+        statname_col = statname_col
+    )
 
-    # On these rows, performing a join using all columns to flag which rows had a value change (i.e there are differences between the stored and new/updated versions). In this case, the newly downloaded version takes precedence.
-    if statname_col is None:
-        update_index_table = update_index_table.merge(querydf, how='left', indicator=True)
+    # Building the update payload for each row that needs updating, from the matching server records
+    payloads = build_update_payloads(
+        updaterows=updaterows,
+        server_index=index_server_records(curr_data),
+        cols_dict=postd2w.ps_col_mappings,
+        statid_col=postd2w.postdf_statcol,
+        dtime_col=postd2w.postdf_datecol,
+        statname_col=statname_col
+    )
+    return (addrows, updaterows, payloads, nunchanged)
+
+# Completes a station once its updates have been sent: new rows are written to csv for posting, and the outcome is summarized in status messages. Returns the station's result, as in reconcile_station
+def finish_station(postd2w, stat, addrows, updaterows, payloads, failures, nunchanged, data_temp_path, mirror=None):
+    messages = [stat]
+    nupdated = len(payloads) - len(failures)
+    messages.append(str(nupdated) + ' rows updated for station ' + stat)
+    if len(failures) > 0:
+        messages.append(str(len(failures)) + ' row updates failed for station ' + stat + ': ' + repr(failures[0][1]))
+    messages.append(str(nunchanged) + ' rows unchanged for station ' + stat)
+
+    # For those that are simple additions, writing to csv for posting
+    if addrows.shape[0] > 0:
+        write_station_rows(stat, addrows, data_temp_path)
+        messages.append(str(addrows.shape[0]) + ' rows to post for station ' + stat)
     else:
-         update_index_table = update_index_table.drop(statname_col, axis=1).merge(querydf.drop(statname_col, axis=1), how='left', indicator=True)
-    # Looking for ones that say left_only - these are the ones that have changed. Everything that says both has remained the same.
-    updaterows = update_index_table[update_index_table._merge == 'left_only'].drop('_merge', axis = 1)
+        messages.append('0 rows to post for station ' + stat)
+    
+    # Updated and newly posted dates change on the server, so the mirror no longer knows their state
+    if mirror is not None:
+        mirror.invalidate(stat, pd.concat([addrows[postd2w.postdf_datecol], updaterows[postd2w.postdf_datecol]]).dt.strftime('%Y-%m-%d'))
+
+    # Reporting the first failed update (if any) as the station's error
+    error = failures[0][1] if len(failures) > 0 else None
+    return {'station': stat, 'messages': messages, 'added': addrows.shape[0], 'updated': nupdated, 'unchanged': nunchanged, 'error': error}
+
+# Times a phase of work in a run's metrics (see RunMetrics), if metrics are being collected
+def timed_phase(metrics, phase):
+    return nullcontext() if metrics is None else metrics.timed(phase)
+
+# Gets the result of a station completed by a previous run, from its entry in the run journal (see RunJournal)
+def resumed_station_result(journal, stat):
+    entry = journal.stations[str(stat)]
+    return {'station': stat, 'messages': [stat, 'Station ' + stat + ' completed by a previous run. Skipping...'], 'added': entry['added'], 'updated': entry['updated'], 'unchanged': entry['unchanged'], 'error': None}
+
+# Gets the result of a station whose reconciliation raised an error, as in reconcile_station
+def station_error_result(stat, e):
+    return {'station': stat, 'messages': [stat, 'Error with station ' + stat + ': ' + repr(e)], 'added': 0, 'updated': 0, 'unchanged': 0, 'error': e}
+
+# Records a completed station in the run journal (if one is provided), unless it failed. Returns the station's result
+def record_station_result(journal, result):
+    if journal is not None and result['error'] is None:
+        journal.record_station(result)
+    return result
+
+# Prints a station's status messages
+def print_station_result(result):
+    for message in result['messages']:
+        print(message)
+
+# Records the row counts of a run's station results in its metrics (if provided), and summarizes any stations that failed
+def summarize_station_results(results, metrics=None):
+    if metrics is not None:
+        metrics.add_results(results)
+    errstats = [result['station'] for result in results if result['error'] is not None]
+    if len(errstats) > 0:
+        print(str(len(errstats)) + ' stations failed to reconcile: ' + ', '.join(errstats))
+
+# Gets the stations in the posting table that still need reconciling, leaving out those a run journal (if provided) records as complete
+def pending_stations(postd2w, journal=None):
+    return [stat for stat in postd2w.postdf[postd2w.postdf_statcol].unique() if journal is None or not journal.is_station_complete(stat)]
+
+# Compares a station's new data against its server records (see compare_station), leaving out any updates a run journal (if provided) records as already sent. Returns a tuple of the rows to add, the rows to update, the update payloads for those rows, the payloads still to be sent, and the number of unchanged rows
+def plan_station(postd2w, updatedf, raw_resp, journal=None):
+    (addrows, updaterows, payloads, nunchanged) = compare_station(postd2w, updatedf, raw_resp)
+    pending = payloads if journal is None else journal.unsent_updates(payloads)
+    return (addrows, updaterows, payloads, pending, nunchanged)
+
+# Reconciles the new data for a single station against the data stored on the d2w server: changed rows are updated directly, and new rows are written to a csv in the temporary directory for posting. Status messages are collected rather than printed, so that concurrent runs can still report their output in station order
+def reconcile_station(client, postd2w, stat, updatedf, start_date, end_date, data_temp_path, raw_resp=None, submitter=None, mirror=None, journal=None, metrics=None):
+    # Getting all current data for the station within the data range, unless it has already been fetched in bulk. If a local mirror is provided, only data missing from the mirror is fetched
+    with timed_phase(metrics, 'fetch'):
+        if raw_resp is None and mirror is not None:
+            raw_resp = get_server_data_mirrored(client, mirror, postd2w.monitoring_type, stat, start_date, end_date)
+        elif raw_resp is None:
+            raw_resp = get_server_data_multipage(
+                client=client,
+                monitoring_type=postd2w.monitoring_type,
+                station_id=stat, 
+                start_date=start_date, 
+                end_date=end_date
+            )
+
+    # If there is no current data present, just pushing new data directly to a csv to be posted
+    if len(raw_resp) == 0:
+        with timed_phase(metrics, 'write'):
+            return post_all_station_rows(postd2w, stat, updatedf, data_temp_path, mirror)
+
+    # Separating rows to add from those to update
+    with timed_phase(metrics, 'compare'):
+        (addrows, updaterows, payloads, pending, nunchanged) = plan_station(postd2w, updatedf, raw_resp, journal)
+
+    # If a run journal is provided, recording each batch of updates as it is sent
+    on_sent = None if journal is None else (lambda sent: journal.record_updates(stat, sent))
+
+    # Posting updates in batches, using a one-off sequential submitter if a shared one isn't provided
+    with timed_phase(metrics, 'update'):
+        if submitter is None:
+            with UpdateSubmitter(client, postd2w.monitoring_type) as submitter:
+                failures = submitter.submit(pending, on_sent)
+        else:
+            failures = submitter.submit(pending, on_sent)
+
+    with timed_phase(metrics, 'write'):
+        return finish_station(postd2w, stat, addrows, updaterows, payloads, failures, nunchanged, data_temp_path, mirror)
+
+# Reconciles every station in the posting table against the d2w server, using a bounded pool of worker threads (the work is almost entirely spent waiting on the network). Output is printed in station order, and an error with one station is reported without stopping the rest of the run. If bulk_fetch is set, the owner's server data for all stations is fetched up-front in a single windowed query. Updates from all stations are sent through a shared submitter, in batches of update_batch_size with at most max_in_flight requests at a time. If a local mirror of the server is provided, per-station fetches only request data the mirror is missing. If a run journal is provided (see RunJournal), stations completed by a previous run are skipped, and each station is recorded in it as it completes. If run metrics are provided (see RunMetrics), the time spent fetching, comparing, updating and writing each station is recorded, along with the row counts of the results. Returns the list of per-station results
+def reconcile_stations(client, postd2w, start_date, end_date, data_temp_path, workers=1, bulk_fetch=False, owner=None, update_batch_size=100, max_in_flight=1, mirror=None, journal=None, metrics=None):
+    (query_start, query_end) = query_date_range(start_date, end_date)
+
+    # Splitting the posting table by station once, rather than filtering the full table for each station
+    station_groups = postd2w.postdf.groupby(postd2w.postdf_statcol, sort=False)
+
+    # Optionally getting the server data for all stations at once
+    server_data = None
+    if bulk_fetch and owner is None:
+        raise ValueError('An owner is required to fetch server data in bulk')
+    if bulk_fetch:
+        print('Fetching server data for all stations...')
+        with timed_phase(metrics, 'bulk_fetch'):
+            server_data = get_server_data_bulk(client, postd2w.monitoring_type, owner, pending_stations(postd2w, journal), query_start, query_end)
+
+    # Wrapper that isolates errors to the station that raised them
+    def reconcile_isolated(group):
+        stat, updatedf = group
+        if journal is not None and journal.is_station_complete(stat):
+            return resumed_station_result(journal, stat)
+        try:
+            raw_resp = None if server_data is None else server_data[stat]
+            return record_station_result(journal, reconcile_station(client, postd2w, stat, updatedf, query_start, query_end, data_temp_path, raw_resp, submitter, mirror, journal, metrics))
+        except Exception as e:
+            return station_error_result(stat, e)
+
+    # Running stations on the worker pool - map returns results in submission order, so output stays ordered
+    results = []
+    submitter = UpdateSubmitter(client, postd2w.monitoring_type, batch_size=update_batch_size, max_in_flight=max_in_flight)
+    with submitter, ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        for result in pool.map(reconcile_isolated, station_groups):
+            print_station_result(result)
+            results.append(result)
+
+    summarize_station_results(results, metrics)
+    return results
+
+# Reconciles the new data for a single station as in reconcile_station, making all requests through the asynchronous client adapter so that the event loop can work on other stations while this one waits on the server. Comparing the data, reading and writing the mirror and journal, and writing csvs are run on the loop's default executor, so that they don't hold up the loop either
+async def reconcile_station_async(aclient, postd2w, stat, updatedf, start_date, end_date, data_temp_path, raw_resp=None, mirror=None, journal=None, metrics=None):
+    loop = asyncio.get_running_loop()
+
+    # Getting all current data for the station within the data range, unless it has already been fetched in bulk. Fetching through the mirror mixes requests with mirror reads and writes, so it is run as a single call on the adapter's request threads
+    with timed_phase(metrics, 'fetch'):
+        if raw_resp is None and mirror is not None:
+            raw_resp = await aclient.call(get_server_data_mirrored, aclient.client, mirror, postd2w.monitoring_type, stat, start_date, end_date)
+        elif raw_resp is None:
+            raw_resp = await aclient.get_data_multipage(postd2w.monitoring_type, station_id=stat, start_date=start_date, end_date=end_date)
+
+    # If there is no current data present, just pushing new data directly to a csv to be posted
+    if len(raw_resp) == 0:
+        with timed_phase(metrics, 'write'):
+            return await loop.run_in_executor(None, post_all_station_rows, postd2w, stat, updatedf, data_temp_path, mirror)
+
+    # Separating rows to add from those to update, and sending all updates at once. Sent updates are recorded in the run journal (if provided) once they are complete
+    with timed_phase(metrics, 'compare'):
+        (addrows, updaterows, payloads, pending, nunchanged) = await loop.run_in_executor(None, plan_station, postd2w, updatedf, raw_resp, journal)
+    with timed_phase(metrics, 'update'):
+        failures = await aclient.update_all(postd2w.monitoring_type, pending)
+    if journal is not None:
+        failed = set(id(updict) for updict, e in failures)
+        await loop.run_in_executor(None, journal.record_updates, stat, [updict for updict in pending if id(updict) not in failed])
+
+    with timed_phase(metrics, 'write'):
+        return await loop.run_in_executor(None, finish_station, postd2w, stat, addrows, updaterows, payloads, failures, nunchanged, data_temp_path, mirror)
+
+# Reconciles every station in the posting table against the d2w server as in reconcile_stations, but on an event loop rather than a pool of worker threads. Stations are started in order, with at most as many in progress as the adapter has request threads (see AsyncD2WClient), and output is printed in station order
+async def reconcile_stations_async(aclient, postd2w, start_date, end_date, data_temp_path, bulk_fetch=False, owner=None, mirror=None, journal=None, metrics=None):
+    loop = asyncio.get_running_loop()
+    (query_start, query_end) = query_date_range(start_date, end_date)
+
+    # Splitting the posting table by station
+    station_groups = postd2w.postdf.groupby(postd2w.postdf_statcol, sort=False)
+
+    # Optionally getting the server data for all stations at once. This is a single chain of pages, so it is fetched with the blocking client
+    server_data = None
+    if bulk_fetch and owner is None:
+        raise ValueError('An owner is required to fetch server data in bulk')
+    if bulk_fetch:
+        print('Fetching server data for all stations...')
+        with timed_phase(metrics, 'bulk_fetch'):
+            server_data = await aclient.call(get_server_data_bulk, aclient.client, postd2w.monitoring_type, owner, pending_stations(postd2w, journal), query_start, query_end)
+
+    # Wrapper that isolates errors to the station that raised them
+    async def reconcile_isolated(stat, updatedf):
+        if journal is not None and journal.is_station_complete(stat):
+            return resumed_station_result(journal, stat)
+        try:
+            raw_resp = None if server_data is None else server_data[stat]
+            result = await reconcile_station_async(aclient, postd2w, stat, updatedf, query_start, query_end, data_temp_path, raw_resp, mirror, journal, metrics)
+            return await loop.run_in_executor(None, record_station_result, journal, result)
+        except Exception as e:
+            return station_error_result(stat, e)
+
+    # Starting stations in order, collecting the oldest station's result whenever the limit of stations in progress is reached
+    results = []
+    running = deque()
+    for stat, updatedf in station_groups:
+        running.append(asyncio.ensure_future(reconcile_isolated(stat, updatedf)))
+        while len(running) >= aclient.max_concurrency or (len(running) > 0 and running[0].done()):
+            result = await running.popleft()
+            print_station_result(result)
+            results.append(result)
+    while len(running) > 0:
+        result = await running.popleft()
+        print_station_result(result)
+        results.append(result)
 
-    # Returning add and update rows as a tuple
-    return (addrows, updaterows)
\ No newline at end of file
+    summarize_station_results(results, metrics)
+    return results